@@ -0,0 +1,154 @@
+import asyncio
+import concurrent.futures
+from threading import Lock, Thread
+from time import time
+
+import requests
+
+import config
+from frameioclient import AsyncFrameioClient
+from frameioclient.async_client import aiohttp
+
+# Responses meaning the asset is gone, or no longer shared with us
+MISSING_STATUSES = {403, 404, 410}
+
+FAILED = object()  # Fetch failed, try again later
+
+CLIENT_CLOSE_DELAY = 300  # Secs before closing a replaced async client
+
+
+class AssetMetadata:
+    """Fetch Frame.io assets for many asset ids at once.
+
+    Requests run concurrently, through AsyncFrameioClient when aiohttp is
+    installed and on a thread pool otherwise, within the client's shared
+    rate limits. The async client lives on one event loop thread for the
+    process, so its connections are reused between calls.
+
+    Complete assets, uploaded and with a checksum, are cached for ttl secs.
+    Others are fetched every time, which polls their checksum.
+
+    :Args:
+    concurrency (int): Max requests in flight
+    ttl (int): Secs to cache complete assets
+    """
+
+    def __init__(self, concurrency, ttl):
+        self.concurrency = concurrency
+        self.ttl = ttl
+        self.cache = {}  # asset_id -> (asset, fetched_at)
+        self.lock = Lock()
+        self.loop = None
+        self.async_client = None  # Only used on the loop thread
+
+    @staticmethod
+    def is_complete(asset):
+        return asset.get('upload_completed_at') is not None and \
+            bool(asset.get('checksums'))
+
+    @staticmethod
+    def failed(error):
+        """Result for an asset whose request failed."""
+        response = error.response
+        if response is not None and response.status_code in MISSING_STATUSES:
+            return None
+        return FAILED
+
+    def fetch(self, client, asset_ids):
+        """Return {asset_id: asset} with None for assets removed from
+        Frame.io. Assets that couldn't be fetched for other reasons are left
+        out, to be tried again later.
+
+        :Args:
+        client (FrameioClient): Authenticated client
+        asset_ids (List)
+        """
+        results = {}
+        missing = []
+        now = time()
+        with self.lock:
+            for asset_id in set(asset_ids):
+                cached = self.cache.get(asset_id)
+                if cached and now - cached[1] < self.ttl:
+                    results[asset_id] = cached[0]
+                else:
+                    missing.append(asset_id)
+
+        if not missing:
+            return results
+
+        if aiohttp is not None:
+            fetched = asyncio.run_coroutine_threadsafe(
+                self.fetch_async(client, missing), self.event_loop()).result()
+        else:
+            fetched = self.fetch_threads(client, missing)
+
+        now = time()
+        with self.lock:
+            for asset_id, asset in zip(missing, fetched):
+                if asset is FAILED:
+                    continue
+
+                results[asset_id] = asset
+                if asset is not None and self.is_complete(asset):
+                    self.cache[asset_id] = (asset, now)
+
+            # Drop expired entries
+            for asset_id in [a for a, (_, fetched_at) in self.cache.items()
+                             if now - fetched_at >= self.ttl]:
+                del self.cache[asset_id]
+
+        return results
+
+    def event_loop(self):
+        with self.lock:
+            if self.loop is None:
+                self.loop = asyncio.new_event_loop()
+                Thread(target=self.loop.run_forever, daemon=True,
+                       name='asset-metadata').start()
+            return self.loop
+
+    def get_async_client(self, client):
+        """AsyncFrameioClient for client's token, replaced when it changes.
+        Called on the loop thread.
+        """
+        async_client = self.async_client
+        if async_client is None or async_client.token != client.token or \
+                async_client.host != client.host:
+            if async_client is not None:
+                # Let requests still using it finish
+                self.loop.call_later(
+                    CLIENT_CLOSE_DELAY,
+                    lambda: self.loop.create_task(async_client.close()))
+
+            self.async_client = AsyncFrameioClient(
+                client.token, host=client.host,
+                max_concurrency=self.concurrency)
+
+        return self.async_client
+
+    async def fetch_async(self, client, asset_ids):
+        async_client = self.get_async_client(client)
+
+        async def get(asset_id):
+            try:
+                return await async_client.get_asset(asset_id)
+            except requests.exceptions.RequestException as e:
+                return self.failed(e)
+
+        return await asyncio.gather(*[get(a) for a in asset_ids])
+
+    def fetch_threads(self, client, asset_ids):
+        def get(asset_id):
+            try:
+                return client.get_asset(asset_id)
+            except requests.exceptions.RequestException as e:
+                return self.failed(e)
+
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.concurrency) as executor:
+            return list(executor.map(get, asset_ids))
+
+
+asset_metadata = AssetMetadata(concurrency=config.ASSET_FETCH_CONCURRENCY,
+                               ttl=config.ASSET_CACHE_TTL)
@@ -0,0 +1,114 @@
+import threading
+from time import time
+
+import requests
+
+import config
+import frameioclient
+from db_handler import db_queue
+from logger import logger
+
+TOKEN_URL = "https://applications.frame.io/oauth2/token"
+
+# Held while refreshing the OAuth token or logging in. Lives here, not in
+# main.py, which also runs as __main__ and would get a second lock.
+client_lock = threading.Lock()
+
+Login = None  # Set by init()
+
+
+def init(login_model):
+    """Use login_model to read and save tokens."""
+    global Login
+    Login = login_model
+
+
+def authenticated_client():
+    """Return authenticated frame.io client either from cache or refresh"""
+    if config.client_expires == 'NEVER':
+        return config.authenticated_client
+    if config.client_expires > time():
+        return config.authenticated_client
+
+    # Sync threads and the UI expire at once, only one refreshes the token.
+    with client_lock:
+        return refresh_client()
+
+
+def refresh_client():
+    # Refreshed while waiting for the lock
+    if config.client_expires == 'NEVER':
+        return config.authenticated_client
+    if config.client_expires > time():
+        return config.authenticated_client
+
+    db = Login._meta.database
+    login = Login.select().limit(1).get()
+    if login.token == '':  # Not logged in
+        logger.info('Not logged in')
+        db.close()
+        return False
+
+    if login.type == 'DEVTOKEN':
+        logger.info('Dev token login found')
+        config.authenticated_client = frameioclient.FrameioClient(login.token)
+        config.client_expires = 'NEVER'
+
+        db.close()
+        return config.authenticated_client
+
+    logger.info('Refreshing OAuth token')
+    tokens = refresh_token(login.refresh_token)
+    if tokens:
+        tokens['type'] = 'OAUTH'
+        save_tokens(tokens)
+        token = tokens['access_token']
+        config.authenticated_client = frameioclient.FrameioClient(token)
+        config.client_expires = time() + 3300  # 5min padding for safety
+
+    else:
+        # Token might be too old, delete it to force use to re-auth
+        logger.info("Couldn't refresh token, signing out")
+
+        login = Login.select().limit(1).get()
+        login.token = ''
+        db_queue.put([login, 'save'])
+        db_queue.join()  # Threads waiting for the lock read the sign out
+
+        return False
+
+    if not db.is_closed():
+        db.close()
+
+    return config.authenticated_client
+
+
+def save_tokens(tokens):
+    """Save tokens to DB."""
+    login = Login.select().limit(1).get()
+
+    login.token = tokens['access_token']
+    login.refresh_token = tokens['refresh_token']
+    login.type = tokens['type']
+    if tokens['type'] == 'DEVTOKEN':
+        login.token_expires = 'NEVER'
+    else:
+        login.token_expires = time() + 3300  # 5min padding for safety
+
+    db_queue.put([login, 'save'])
+    Login._meta.database.close()
+
+
+def refresh_token(token):
+    """Refreshes token and returns new token/refresh pair."""
+    post_data = {
+        "grant_type": "refresh_token",
+        "scope": config.SCOPES,
+        "refresh_token": token,
+        "client_id": config.CLIENT_ID
+    }
+
+    response = requests.post(TOKEN_URL, data=post_data)
+    if response.status_code == 200:
+        return response.json()
+    return False
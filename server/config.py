@@ -5,7 +5,96 @@ DB_FOLDER = 'db'
 os.makedirs('db', exist_ok=True)
 
 CONSOLE_LOG = True
+
+# Sync tasks run again BUSY_INTERVAL secs after finding work. While idle
+# they back off up to SCAN_INTERVAL secs, failed ones up to TASK_RETRY_MAX.
+BUSY_INTERVAL = 5
 SCAN_INTERVAL = 60
+TASK_RETRY_MAX = 600
+
+# Watch local folders with inotify (Linux only) instead of just polling
+LOCAL_WATCH = os.getenv('LOCAL_WATCH', 'false').lower() == 'true'
+WATCH_SETTLE_TIME = 5  # Secs without changes before a file is picked up
+WATCH_RECONCILE_INTERVAL = 3600  # Secs between full scans in watch mode
+
+# Frame.io changes newer than this many secs are fetched again on the next
+# scan too, in case the search index lags. Changes that can't be added yet
+# are retried for FRAMEIO_RETRY_TIME secs.
+FRAMEIO_INDEX_LAG = 60
+FRAMEIO_RETRY_TIME = 86400
+
+# Frame.io webhooks. With a secret set, asset events posted to /api/webhook
+# trigger a sync of their project, and projects are only searched for other
+# changes every WEBHOOK_RECONCILE_INTERVAL secs.
+WEBHOOK_SECRET = os.getenv('FRAMEIO_WEBHOOK_SECRET', '')
+WEBHOOK_MAX_AGE = 300  # Secs, older requests are rejected
+WEBHOOK_RECONCILE_INTERVAL = 600
+
+# Secs to cache the Frame.io team and project lists
+PROJECT_CACHE_TTL = 300
+
+# Max projects scanned at once
+PROJECT_WORKERS = int(os.getenv('PROJECT_WORKERS', 4))
+
+# Max concurrent file transfers
+UPLOAD_WORKERS = int(os.getenv('UPLOAD_WORKERS', 3))
+DOWNLOAD_WORKERS = int(os.getenv('DOWNLOAD_WORKERS', 3))
+
+# Shared Frame.io HTTP connection pool
+HTTP_POOL_CONNECTIONS = 10  # Hosts to keep pools for
+HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', 20))  # Connections per host
+HTTP_KEEPALIVE_IDLE = 60  # Secs before TCP keep-alive probes
+
+# Frame.io API pagination. The next API_PAGE_PREFETCH pages are fetched in
+# the background, by up to API_PAGE_WORKERS threads shared by all listings
+API_PAGE_SIZE = int(os.getenv('API_PAGE_SIZE', 100))
+API_PAGE_PREFETCH = 4
+API_PAGE_WORKERS = 8
+
+# Frame.io API request budgets shared by all threads, per category:
+# (requests per sec, burst). 'uploads' covers upload chunks.
+API_RATE_LIMITS = {
+    'search': (5, 10),
+    'assets': (10, 20),
+    'uploads': (50, 100),
+    'default': (10, 20)
+}
+
+# Chunks sent of unfinished uploads, to resume them
+UPLOAD_STATE_FOLDER = os.path.join(DB_FOLDER, 'uploads')
+
+# Upload chunks are streamed through buffers of UPLOAD_BUFFER_SIZE, with
+# at most UPLOAD_MEMORY_BUDGET bytes of them shared by all uploads
+UPLOAD_MEMORY_BUDGET = int(os.getenv('UPLOAD_MEMORY_BUDGET', 67108864))
+UPLOAD_BUFFER_SIZE = 1048576
+
+# Downloads of at least DOWNLOAD_MULTIPART_MIN_SIZE are fetched in parallel
+# Range requests of DOWNLOAD_PART_SIZE
+DOWNLOAD_CHUNK_SIZE = 1048576  # Bytes read from socket at a time
+DOWNLOAD_PART_SIZE = 67108864
+DOWNLOAD_MULTIPART_MIN_SIZE = 134217728
+
+# Parts in flight across all uploads and all downloads. Starts at *_PARTS,
+# then follows measured throughput up to *_PARTS_MAX and halves on 429/503
+UPLOAD_PARTS = 8
+UPLOAD_PARTS_MAX = int(os.getenv('UPLOAD_PARTS_MAX', 32))
+DOWNLOAD_PARTS = 8
+DOWNLOAD_PARTS_MAX = int(os.getenv('DOWNLOAD_PARTS_MAX', 32))
+
+# Frame.io asset metadata for downloads and upload verification is fetched
+# in batches of ASSET_FETCH_BATCH, with up to ASSET_FETCH_CONCURRENCY
+# requests at once. Uploaded assets with a checksum are cached.
+ASSET_FETCH_BATCH = 200
+ASSET_FETCH_CONCURRENCY = 10
+ASSET_CACHE_TTL = 300
+
+# Cache of local file hashes, reused while size, mtime and inode match
+HASH_CACHE_SIZE = 100000  # Entries kept in memory
+HASH_CACHE_TTL = 2592000  # 30 days, re-hash after this even if unchanged
+
+# DB writer commits queued rows in batches of this size or age
+DB_BATCH_SIZE = 500
+DB_BATCH_TIMEOUT = 200  # ms
 
 # OAuth login
 # Default CLIENT_ID configured by m@maxstr.se. 
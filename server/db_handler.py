@@ -1,11 +1,40 @@
-
 from threading import Thread
+from time import time, sleep
 import queue
+
+from peewee import OperationalError, chunked, fn
+
+import config
 from logger import logger
 
-db_queue = queue.Queue() 
+db_queue = queue.Queue()
+
+db_stats = {
+    'batches': 0,
+    'rows_written': 0,
+    'last_batch_size': 0,
+    'last_commit_ms': 0.0,
+    'avg_commit_ms': 0.0,
+}
+
+SQLITE_MAX_VARIABLES = 900  # Stay below SQLite's default limit of 999
+
+
+def queue_stats():
+    """Return writer stats together with current DB queue depth."""
+    stats = dict(db_stats)
+    stats['queue_depth'] = db_queue.qsize()
+    return stats
+
 
 class WriteQueueConsumer(Thread):
+    """Drain db_queue and write rows in batched transactions.
+
+    Up to DB_BATCH_SIZE items, or what arrives within DB_BATCH_TIMEOUT ms,
+    are committed together. Repeated writes to the same row are coalesced so
+    only the last one is applied.
+    """
+
     def __init__(self, db, **kwargs):
         super().__init__(**kwargs)
         self.daemon = True
@@ -13,15 +42,158 @@ class WriteQueueConsumer(Thread):
 
     def run(self):
         while True:
-            row, action = db_queue.get()
-            
-            if action == "save":
-                row.save()
-            elif action == "delete":
-                row.delete_instance()
-            else:
+            batch = self.next_batch()
+
+            start = time()
+            self.write_batch(batch)
+            commit_ms = (time() - start) * 1000
+
+            db_stats['batches'] += 1
+            db_stats['rows_written'] += len(batch)
+            db_stats['last_batch_size'] = len(batch)
+            db_stats['last_commit_ms'] = round(commit_ms, 2)
+            db_stats['avg_commit_ms'] = round(
+                0.9 * db_stats['avg_commit_ms'] + 0.1 * commit_ms, 2)
+
+            self.db.close()
+            for _ in batch:
+                db_queue.task_done()
+
+    @staticmethod
+    def next_batch():
+        batch = [db_queue.get()]
+        deadline = time() + config.DB_BATCH_TIMEOUT / 1000
+
+        while len(batch) < config.DB_BATCH_SIZE:
+            try:
+                batch.append(db_queue.get(timeout=max(deadline - time(), 0)))
+            except queue.Empty:
+                break
+
+        return batch
+
+    @staticmethod
+    def coalesce(batch):
+        """Keep the last write per row, grouped by action and model. A
+        delete is final, later saves of the row in the batch are dropped like
+        they'd update no row after it.
+        """
+        writes = {}
+        for row, action in batch:
+            if action not in ('save', 'delete'):
                 logger.error('Bad DB write operation - Use save or delete')
                 raise Exception
 
-            self.db.close()
-            db_queue.task_done()
+            # Unsaved rows have no primary key, use the object itself.
+            key = id(row) if row._pk is None else (type(row), row._pk)
+            if key in writes and writes[key][1] == 'delete':
+                continue
+
+            writes.pop(key, None)
+            writes[key] = (row, action)
+
+        inserts, updates, deletes = {}, {}, {}
+        for row, action in writes.values():
+            if action == 'delete':
+                if row._pk is not None:
+                    deletes.setdefault(type(row), []).append(row)
+            elif row._pk is None:
+                inserts.setdefault(type(row), []).append(row)
+            else:
+                updates.setdefault(type(row), []).append(row)
+
+        return inserts, updates, deletes
+
+    def write_batch(self, batch):
+        inserts, updates, deletes = self.coalesce(batch)
+
+        while True:
+            try:
+                # Take the write lock up front so allocated ids stay free.
+                with self.db.atomic('IMMEDIATE'):
+                    self.bulk_delete(deletes)
+                    self.bulk_update(updates)
+                    self.bulk_insert(inserts)
+                break
+
+            except OperationalError as e:
+                self.reset_ids(inserts)
+                if 'locked' in str(e):  # Wait for DB write lock
+                    sleep(0.5)
+                    continue
+
+                self.write_rows_after_error(batch)
+                break
+
+            except Exception:  # skipcq: PYL-W0703
+                self.reset_ids(inserts)
+                self.write_rows_after_error(batch)
+                break
+
+    @staticmethod
+    def bulk_delete(deletes):
+        for model, rows in deletes.items():
+            pk = model._meta.primary_key
+            for ids in chunked([row._pk for row in rows],
+                               SQLITE_MAX_VARIABLES):
+                model.delete().where(pk.in_(ids)).execute()
+
+    @staticmethod
+    def bulk_update(updates):
+        for model, rows in updates.items():
+            if len(rows) == 1:
+                rows[0].save()
+                continue
+
+            fields = [f for f in model._meta.sorted_fields
+                      if f is not model._meta.primary_key]
+            batch_size = max(SQLITE_MAX_VARIABLES // (2 * len(fields) + 1), 1)
+            model.bulk_update(rows, fields=fields, batch_size=batch_size)
+
+            for row in rows:
+                row._dirty.clear()
+
+    @staticmethod
+    def bulk_insert(inserts):
+        """Insert new rows with explicitly allocated ids.
+
+        SQLite can't return ids from a multi-row insert, so ids are assigned
+        the same way SQLite would (max + 1) and set on the row objects. Later
+        saves of the same objects then update instead of inserting again.
+        """
+        for model, rows in inserts.items():
+            pk = model._meta.primary_key
+            next_id = (model.select(fn.MAX(pk)).scalar() or 0) + 1
+            for row in rows:
+                row._pk = next_id
+                next_id += 1
+
+            fields = model._meta.sorted_fields
+            data = [{field: row.__data__.get(field.name) for field in fields}
+                    for row in rows]
+            for chunk in chunked(data, SQLITE_MAX_VARIABLES // len(fields)):
+                model.insert_many(chunk).execute()
+
+            for row in rows:
+                row._dirty.clear()
+
+    @staticmethod
+    def reset_ids(inserts):
+        """Forget ids allocated in a transaction that was rolled back."""
+        for rows in inserts.values():
+            for row in rows:
+                row._pk = None
+
+    @staticmethod
+    def write_rows_after_error(batch):
+        """Fall back to one write per row so a single bad row is skipped."""
+        logger.exception('Batch write failed, writing rows one by one')
+        for row, action in batch:
+            try:
+                if action == 'save':
+                    row.save()
+                else:
+                    row.delete_instance()
+            except Exception:  # skipcq: PYL-W0703
+                logger.exception('Could not {} {} row'.format(
+                    action, type(row).__name__))
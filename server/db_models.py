@@ -1,7 +1,80 @@
-from peewee import Model, CharField, IntegerField, BooleanField
+from peewee import Model, CharField, IntegerField, BooleanField, TextField
+from playhouse.migrate import SqliteMigrator, migrate
 from config import SYSTEM_FOLDERS
 
 
+def add_columns(db, table, fields):
+    """Add columns {name: field} the table doesn't have yet."""
+    migrator = SqliteMigrator(db)
+    columns = [column.name for column in db.get_columns(table)]
+
+    for name, field in fields.items():
+        if name not in columns:
+            migrate(migrator.add_column(table, name, field))
+
+
+def add_indexes(db, table, indexes):
+    """Add indexes, each a tuple of columns, named like peewee does."""
+    for columns in indexes:
+        db.execute_sql('CREATE INDEX IF NOT EXISTS "{}_{}" ON "{}" ({})'.format(
+            table, '_'.join(columns), table,
+            ', '.join('"{}"'.format(column) for column in columns)))
+
+
+# Each migration adds a fixed set of columns or indexes, so a schema version
+# always means the same schema. New DBs are created with the current models
+# and start at the latest version.
+
+def migration_project_priority(db):
+    add_columns(db, 'project', {'priority': IntegerField(default=0)})
+
+
+def migration_asset_indexes(db):
+    add_indexes(db, 'asset', [
+        ('asset_id',),
+        ('parent_id',),
+        ('upload_verified',),
+        ('project_id', 'path'),
+        ('project_id', 'on_frameio', 'is_file'),
+        ('project_id', 'on_local_storage', 'ignore'),
+    ])
+    db.execute_sql('ANALYZE')  # Let the query planner pick the new indexes
+
+
+def migration_project_frameio_cursor(db):
+    add_columns(db, 'project', {
+        'last_frameio_id': CharField(default=''),
+        'frameio_retry': TextField(default='{}'),
+    })
+
+
+# Schema version N is reached by running MIGRATIONS[N - 1].
+# Only append to this list, existing entries may already have run.
+MIGRATIONS = [
+    migration_project_priority,
+    migration_asset_indexes,
+    migration_project_frameio_cursor,
+]
+
+
+def run_migrations(db, new):
+    """Upgrade an existing DB in place, tracked with PRAGMA user_version.
+
+    :Args:
+    db (SqliteDatabase)
+    new (bool): Tables were just created with the current schema
+    """
+    if new:
+        db.pragma('user_version', len(MIGRATIONS))
+        return
+
+    for version, migration in enumerate(MIGRATIONS, 1):
+        if db.pragma('user_version') < version:
+            with db.atomic():
+                migration(db)
+                db.pragma('user_version', version)
+
+
 def init_log_model(db):
     class BaseModel(Model):
         class Meta:
@@ -19,6 +92,27 @@ def init_log_model(db):
     return LogMessage
 
 
+def init_hash_model(db):
+    class BaseModel(Model):
+        class Meta:
+            database = db
+
+    class FileHash(BaseModel):
+        path = CharField(unique=True)
+        size = IntegerField()
+        mtime_ns = IntegerField()
+        inode = IntegerField()
+        xxhash = CharField()
+        hashed_at = IntegerField()
+
+    if db.is_closed():
+        db.connect()
+
+    db.create_tables([FileHash])
+
+    return FileHash
+
+
 def init_sync_models(db):
     class BaseModel(Model):
         class Meta:
@@ -37,10 +131,17 @@ def init_sync_models(db):
         team_id = CharField(default='')
         local_path = CharField(default='')
         local_path_changed = BooleanField(default=False)
+        priority = IntegerField(default=0)  # Lower transfers first
 
         sync = BooleanField(default=False)
+        # Frame.io changes are fetched after (last_frameio_scan,
+        # last_frameio_id), the updated_at and id of the last one handled
         last_frameio_scan = CharField(
             default='2014-02-07T00:00:01.000000+00:00')
+        last_frameio_id = CharField(default='')
+        # JSON {asset_id: first seen} of changes to retry, e.g. files whose
+        # parent folder wasn't found yet
+        frameio_retry = TextField(default='{}')
         last_local_scan = IntegerField(default=0)
         deleted_from_frameio = BooleanField(default=False)
         db_delete_requested = BooleanField(default=False)
@@ -49,8 +150,8 @@ def init_sync_models(db):
         name = CharField()
         path = CharField()  # relative to project root
         is_file = BooleanField(default=False)
-        asset_id = CharField(default='')
-        parent_id = CharField(default='')
+        asset_id = CharField(default='', index=True)
+        parent_id = CharField(default='', index=True)
         project_id = CharField()
         original = CharField(default='')
 
@@ -61,9 +162,18 @@ def init_sync_models(db):
         frameio_xxhash = CharField(default='')
 
         uploaded_at = IntegerField(default=0)
-        upload_verified = BooleanField(default=True)
+        upload_verified = BooleanField(default=True, index=True)
         upload_retries = IntegerField(default=0)
 
+        class Meta:
+            # Not unique: local assets have no asset_id and duplicate
+            # Frame.io folders are stored with the same path.
+            indexes = (
+                (('project_id', 'path'), False),
+                (('project_id', 'on_frameio', 'is_file'), False),
+                (('project_id', 'on_local_storage', 'ignore'), False),
+            )
+
     class IgnoreFolder(BaseModel):
         name = CharField()
         type = CharField()
@@ -72,7 +182,9 @@ def init_sync_models(db):
     if db.is_closed():
         db.connect()
 
+    new = not db.table_exists(Project._meta.table_name)
     db.create_tables([Project, Asset, Login, IgnoreFolder])
+    run_migrations(db, new)
 
     config = Login.get_or_none()
     if config is None:
@@ -0,0 +1,90 @@
+from threading import Event, Lock
+
+# SyncLoop tasks: the Frame.io project list, ignore folders, upload
+# verification, and per project Frame.io changes and local scans.
+SYNC_TASKS = ('projects', 'ignore', 'verify', 'remote', 'local')
+PROJECT_TASKS = ('remote', 'local')  # Run per project by ProjectPool
+
+
+class SyncWakeup:
+    """Run SyncLoop tasks now instead of at their next deadline.
+
+    set() wakes the named tasks, or all tasks without names. With a
+    project_id, only that project's tasks are woken, e.g. 'local' when the
+    watcher saw its files settle.
+    """
+
+    def __init__(self):
+        self.event = Event()
+        self.tasks = set()
+        self.project_tasks = {}  # project_id -> set of tasks
+        self.lock = Lock()
+
+    def set(self, *tasks, project_id=None):
+        allowed = SYNC_TASKS if project_id is None else PROJECT_TASKS
+        unknown = set(tasks) - set(allowed)
+        if unknown:
+            raise ValueError('Unknown sync tasks {}'.format(unknown))
+
+        with self.lock:
+            if project_id is None:
+                self.tasks.update(tasks or allowed)
+            else:
+                self.project_tasks.setdefault(project_id, set()).update(
+                    tasks or allowed)
+            self.event.set()
+
+    def is_set(self):
+        return self.event.is_set()
+
+    def wait(self, timeout=None):
+        return self.event.wait(timeout)
+
+    def take(self):
+        """Return and clear the woken tasks, and the woken tasks per
+        project as {project_id: tasks}.
+        """
+        with self.lock:
+            tasks, project_tasks = self.tasks, self.project_tasks
+            self.tasks = set()
+            self.project_tasks = {}
+            self.event.clear()
+            return tasks, project_tasks
+
+
+sync_wakeup = SyncWakeup()
+
+
+class RemoteEvents:
+    """Frame.io webhook events waiting for their project's next sync pass.
+
+    Only the latest event per asset is kept.
+    """
+
+    def __init__(self):
+        self.events = {}  # project_id -> {asset_id: event type}
+        self.lock = Lock()
+
+    def add(self, project_id, asset_id, event_type):
+        with self.lock:
+            self.events.setdefault(project_id, {})[asset_id] = event_type
+
+    def take(self, project_id):
+        """Return and forget the project's events, {asset_id: type}."""
+        with self.lock:
+            return self.events.pop(project_id, {})
+
+    def put_back(self, project_id, events):
+        """Return taken events that couldn't be handled. Events that came in
+        since are newer and kept.
+        """
+        if not events:
+            return
+
+        with self.lock:
+            current = self.events.setdefault(project_id, {})
+            for asset_id, event_type in events.items():
+                current.setdefault(asset_id, event_type)
+
+
+remote_events = RemoteEvents()
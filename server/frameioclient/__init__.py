@@ -1,2 +1,3 @@
 from .client import FrameioClient
-from .utils import stream
\ No newline at end of file
+from .async_client import AsyncFrameioClient
+from .utils import stream
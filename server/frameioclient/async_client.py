@@ -0,0 +1,272 @@
+import asyncio
+import math
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from config import (TELEMETRY_HEADERS, HTTP_POOL_SIZE, HTTP_KEEPALIVE_IDLE,
+                    API_PAGE_PREFETCH)
+from .client import FrameioClient, rate_limiter
+
+try:
+  import aiohttp
+except ImportError:  # Optional, only needed for AsyncFrameioClient
+  aiohttp = None
+
+# Statuses retried per method, like the Retry strategies of FrameioClient.
+# 429 is retried for all methods, after the rate limiter paused.
+RETRY_STATUSES = {
+  'get': {408, 500, 502, 503, 504}
+}
+
+
+class AsyncPaginatedResponse(object):
+  """
+  Async counterpart of PaginatedResponse. Iterate with async for, the next
+  prefetch pages are requested while the current one is consumed.
+  """
+  def __init__(self, results=[], limit=None, page_size=0, total=0,
+               total_pages=0, endpoint=None, method=None, payload={},
+               client=None, prefetch=API_PAGE_PREFETCH):
+    self.first_page = results
+    self.results = results
+
+    self.limit = limit
+    self.page_size = int(page_size)
+    self.total = int(total)
+    self.total_pages = int(total_pages)
+
+    self.endpoint = endpoint
+    self.method = method
+    self.payload = payload
+    self.client = client
+    self.prefetch = prefetch
+
+    self.asset_index = 0   # Index on current page
+    self.returned = 0      # Total returned count
+    self.current_page = 1
+    self.pending = {}      # Page number -> Task
+
+  def _last_page(self):
+    if self.limit and self.page_size:
+      return min(self.total_pages,
+                 int(math.ceil(self.limit / float(self.page_size))))
+    return self.total_pages
+
+  def _fetch_ahead(self):
+    last_page = min(self._last_page(), self.current_page + self.prefetch)
+    for page in range(self.current_page + 1, last_page + 1):
+      if page not in self.pending:
+        self.pending[page] = asyncio.ensure_future(
+          self.client.get_specific_page(self.method, self.endpoint,
+                                        self.payload, page))
+
+  async def _next_page(self):
+    self.current_page += 1
+    task = self.pending.pop(self.current_page, None)
+    self._fetch_ahead()
+
+    if task is None:  # No prefetch
+      task = self.client.get_specific_page(
+        self.method, self.endpoint, self.payload, self.current_page)
+    return (await task).results
+
+  def __aiter__(self):
+    for task in self.pending.values():
+      task.cancel()
+
+    self.pending = {}
+    self.results = self.first_page
+    self.asset_index = 0
+    self.returned = 0
+    self.current_page = 1
+    return self
+
+  async def __anext__(self):
+    if self.returned == self.limit or self.returned >= self.total:
+      raise StopAsyncIteration
+
+    if self.returned == 0:
+      self._fetch_ahead()
+
+    if self.asset_index >= len(self.results):
+      if self.current_page >= self.total_pages:
+        raise StopAsyncIteration
+
+      self.results = await self._next_page()
+      self.asset_index = 0
+      if not self.results:
+        raise StopAsyncIteration
+
+    self.asset_index += 1
+    self.returned += 1
+    return self.results[self.asset_index - 1]
+
+  def __len__(self):
+    if self.limit and self.limit < self.total:
+      return self.limit
+
+    return self.total
+
+
+class AsyncFrameioClient(FrameioClient):
+  """
+  FrameioClient with the API methods as coroutines, for running many
+  metadata requests at once. Requires aiohttp.
+
+  Requests share one connection pool, and at most max_concurrency are in
+  flight. Errors are raised as the same requests exceptions FrameioClient
+  raises, so callers can handle both alike.
+
+    Example::
+
+      async with AsyncFrameioClient(token) as client:
+        assets = await asyncio.gather(
+          *[client.get_asset(asset_id) for asset_id in asset_ids])
+
+  :Args:
+    token (string): Frame.io token
+    host (string): API host
+    max_concurrency (int): Max requests in flight
+  """
+  def __init__(self, token, host='https://api.frame.io',
+               max_concurrency=HTTP_POOL_SIZE):
+    if aiohttp is None:
+      raise ImportError('AsyncFrameioClient requires aiohttp')
+
+    self.token = token
+    self.host = host
+    self.client_version = '3.6.8'
+    self.max_concurrency = max_concurrency
+    self.retries = 3
+    self.backoff_factor = 1
+    self.headers = {
+      'Authorization': 'Bearer {}'.format(self.token),
+      'x-frameio-client': "{}/{}".format(TELEMETRY_HEADERS['x-client-name'], TELEMETRY_HEADERS['x-client-version']),
+      **TELEMETRY_HEADERS
+    }
+
+    # Created on first request, inside the running event loop
+    self.session = None
+    self.semaphore = None
+    self.sync_client = None
+
+  async def __aenter__(self):
+    return self
+
+  async def __aexit__(self, *exc):
+    await self.close()
+
+  def _get_session(self):
+    if self.session is None or self.session.closed:
+      connector = aiohttp.TCPConnector(
+        limit=self.max_concurrency,
+        keepalive_timeout=HTTP_KEEPALIVE_IDLE
+      )
+      self.session = aiohttp.ClientSession(
+        connector=connector,
+        headers=self.headers,
+        timeout=aiohttp.ClientTimeout(total=300)
+      )
+      self.semaphore = asyncio.Semaphore(self.max_concurrency)
+
+    return self.session
+
+  async def close(self):
+    if self.session is not None:
+      await self.session.close()
+      self.session = None
+
+  @staticmethod
+  def _response(r, body):
+    """Build a requests Response, to raise the usual HTTPError."""
+    response = requests.Response()
+    response.status_code = r.status
+    response.reason = r.reason
+    response.url = str(r.url)
+    response.headers = CaseInsensitiveDict(r.headers)
+    response._content = body
+    return response
+
+  def _backoff(self, attempt, headers):
+    retry_after = headers.get('Retry-After')
+    if retry_after and retry_after.isdigit():
+      return int(retry_after)
+
+    if attempt <= 1:
+      return 0
+    return self.backoff_factor * (2 ** (attempt - 1))
+
+  async def _request(self, method, url, payload, category):
+    """Send request, retrying like FrameioClient. Returns (response, body)."""
+    session = self._get_session()
+    attempt = 0
+    while True:
+      await asyncio.sleep(rate_limiter.reserve(category))
+      try:
+        async with self.semaphore:
+          async with session.request(method, url, json=payload) as r:
+            body = await r.read()
+
+      except asyncio.TimeoutError as e:
+        raise requests.exceptions.Timeout(e)
+      except aiohttp.ClientError as e:  # Connection and payload errors
+        raise requests.exceptions.ConnectionError(e)
+
+      attempt += 1
+      if rate_limiter.observe(category, r.status, r.headers):
+        if attempt > self.retries:
+          return r, body
+        continue  # Bucket is paused for Retry-After
+
+      if r.status not in RETRY_STATUSES.get(method, ()) or \
+          attempt > self.retries:
+        return r, body
+
+      await asyncio.sleep(self._backoff(attempt, r.headers))
+
+  async def _api_call(self, method, endpoint, payload={}, limit=None,
+                      conditional=False):
+    """Like FrameioClient._api_call, conditional requests aren't cached."""
+    url = '{}/v2{}'.format(self.host, endpoint)
+    r, body = await self._request(method, url, payload,
+                                  rate_limiter.category(endpoint))
+    response = self._response(r, body)
+
+    if response.ok:
+      if r.headers.get('page-number'):
+        if int(r.headers.get('total-pages')) > 1:
+          return AsyncPaginatedResponse(
+            results=response.json(),
+            limit=limit,
+            page_size=r.headers['per-page'],
+            total_pages=r.headers['total-pages'],
+            total=r.headers['total'],
+            endpoint=endpoint,
+            method=method,
+            payload=payload,
+            client=self
+          )
+      if isinstance(response.json(), list):
+        return response.json()[:limit]
+      return response.json()
+
+    return response.raise_for_status()
+
+  async def _run_sync(self, func_name, *args, **kwargs):
+    """Run a blocking FrameioClient method in the default executor."""
+    if self.sync_client is None:
+      self.sync_client = FrameioClient(self.token, host=self.host)
+
+    func = getattr(self.sync_client, func_name)
+    return await asyncio.get_running_loop().run_in_executor(
+      None, lambda: func(*args, **kwargs))
+
+  async def upload(self, asset, file, state=None):
+    """Upload an asset in a worker thread, see FrameioClient.upload."""
+    return await self._run_sync('upload', asset, file, state=state)
+
+  async def download(self, asset, download_folder, replace=True):
+    """Download an asset in a worker thread, see FrameioClient.download."""
+    return await self._run_sync('download', asset, download_folder,
+                                replace=replace)
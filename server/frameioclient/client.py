@@ -1,22 +1,56 @@
+import copy
+import math
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
-import requests
-from requests.adapters import HTTPAdapter
 from requests.packages.urllib3.util.retry import Retry
-from config import TELEMETRY_HEADERS
-
-from .download import FrameioDownloader
+from config import (TELEMETRY_HEADERS, HTTP_POOL_CONNECTIONS, HTTP_POOL_SIZE,
+                    HTTP_KEEPALIVE_IDLE, DOWNLOAD_CHUNK_SIZE,
+                    DOWNLOAD_PART_SIZE, DOWNLOAD_MULTIPART_MIN_SIZE,
+                    UPLOAD_MEMORY_BUDGET, UPLOAD_BUFFER_SIZE, UPLOAD_PARTS,
+                    UPLOAD_PARTS_MAX, DOWNLOAD_PARTS, DOWNLOAD_PARTS_MAX,
+                    API_PAGE_SIZE, API_PAGE_PREFETCH, API_PAGE_WORKERS,
+                    API_RATE_LIMITS)
+
+from .concurrency import AdaptiveLimiter
+from .download import FrameioDownloader, http_retry_strategy
+from .ratelimit import RateLimiter
+from .transport import create_session
+
+# Shared by all clients, so request budgets hold across threads
+rate_limiter = RateLimiter(API_RATE_LIMITS)
+
+# Fetches pages ahead for all PaginatedResponses
+page_fetcher = ThreadPoolExecutor(max_workers=API_PAGE_WORKERS)
+
+# Shared by all clients, so parts in flight adapt to the whole link
+upload_limiter = AdaptiveLimiter(initial=UPLOAD_PARTS,
+                                 max_limit=UPLOAD_PARTS_MAX)
+download_limiter = AdaptiveLimiter(initial=DOWNLOAD_PARTS,
+                                   max_limit=DOWNLOAD_PARTS_MAX)
 
 if sys.version_info.major >= 3:
-  from .next_uploader import FrameioUploader
+  from .next_uploader import BufferPool, FrameioUploader
+
+  # Shared by all clients, so concurrent uploads stay within the budget
+  upload_buffers = BufferPool(UPLOAD_MEMORY_BUDGET, UPLOAD_BUFFER_SIZE)
 else:
   from .py2_uploader import FrameioUploader
 
 
 class PaginatedResponse(object):
+  """
+  Iterates results of all pages, starting with the first page's results.
+
+  The next prefetch pages are requested in the background while the
+  current one is consumed, so with prefetch >= total_pages all pages are
+  fetched at once. Iterating again starts over from the first page.
+  """
   def __init__(self, results=[], limit=None, page_size=0, total=0,
                total_pages=0, endpoint=None, method=None, payload={},
-               client=None):
+               client=None, prefetch=API_PAGE_PREFETCH):
+    self.first_page = results
     self.results = results
 
     self.limit = limit
@@ -28,45 +62,67 @@ class PaginatedResponse(object):
     self.method = method
     self.payload = payload
     self.client = client
+    self.prefetch = prefetch
 
     self.asset_index = 0   # Index on current page
     self.returned = 0      # Total returned count
     self.current_page = 1
+    self.pending = {}      # Page number -> Future
+
+  def _last_page(self):
+    if self.limit and self.page_size:
+      return min(self.total_pages,
+                 int(math.ceil(self.limit / float(self.page_size))))
+    return self.total_pages
+
+  def _fetch_ahead(self):
+    last_page = min(self._last_page(), self.current_page + self.prefetch)
+    for page in range(self.current_page + 1, last_page + 1):
+      if page not in self.pending:
+        self.pending[page] = page_fetcher.submit(
+          self.client.get_specific_page, self.method, self.endpoint,
+          self.payload, page)
+
+  def _next_page(self):
+    self.current_page += 1
+    future = self.pending.pop(self.current_page, None)
+    self._fetch_ahead()
+
+    if future is None:  # No prefetch
+      return self.client.get_specific_page(
+        self.method, self.endpoint, self.payload, self.current_page).results
+    return future.result().results
 
   def __iter__(self):
+    for future in self.pending.values():
+      future.cancel()
+
+    self.pending = {}
+    self.results = self.first_page
+    self.asset_index = 0
+    self.returned = 0
+    self.current_page = 1
     return self
 
   def __next__(self):
-    # Reset if we've reached end
-    if self.returned == self.limit or self.returned == self.total:
-      self.asset_index = 0
-      self.returned = 0
-      self.current_page = 1
-
-      self.results = self.client.get_specific_page(
-        self.method, self.endpoint, self.payload, page=1).results
+    if self.returned == self.limit or self.returned >= self.total:
       raise StopIteration
 
-    if self.limit is None or self.returned < self.limit:
-      if self.asset_index < self.page_size and self.returned < self.total:
-        self.asset_index += 1
-        self.returned += 1
-        try:
-          return self.results[self.asset_index - 1]
-        except IndexError:
-          raise StopIteration
-
-      if self.current_page < self.total_pages:
-        self.current_page += 1
-        self.asset_index = 1
-        self.returned += 1
+    if self.returned == 0:
+      self._fetch_ahead()
 
-        self.results = self.client.get_specific_page(
-          self.method, self.endpoint, self.payload, self.current_page).results
+    if self.asset_index >= len(self.results):
+      if self.current_page >= self.total_pages:
+        raise StopIteration
 
-        return self.results[self.asset_index - 1]
+      self.results = self._next_page()
+      self.asset_index = 0
+      if not self.results:
+        raise StopIteration
 
-    raise StopIteration
+    self.asset_index += 1
+    self.returned += 1
+    return self.results[self.asset_index - 1]
 
   def next(self):  # Python 2
     return self.__next__()
@@ -82,14 +138,35 @@ class FrameioClient(object):
   def __init__(self, token, host='https://api.frame.io'):
     self.token = token
     self.host = host
+    # 429 is retried in _api_call, after the rate limiter paused
     self.retry_strategy = Retry(
       total=3,
       backoff_factor=1,
-      status_forcelist=[429],
-      method_whitelist=["POST", "OPTIONS", "GET"]
+      status_forcelist=[],
+      method_whitelist=["POST", "OPTIONS", "GET"],
+      respect_retry_after_header=False
     )
+    self.rate_limit_retries = 3
     self.client_version = '3.6.8'
 
+    # url -> (ETag, Last-Modified, result) of conditional GETs
+    self.validators = {}
+    self.validators_lock = threading.Lock()
+
+    # Shared by API calls, pagination and downloads. Uploads use their own.
+    # Auth headers are only sent with API calls, never to download hosts.
+    self.session = create_session(
+      {'https://': http_retry_strategy, self.host: self.retry_strategy},
+      pool_connections=HTTP_POOL_CONNECTIONS,
+      pool_maxsize=HTTP_POOL_SIZE,
+      keepalive_idle=HTTP_KEEPALIVE_IDLE
+    )
+    self.api_headers = {
+      'Authorization': 'Bearer {}'.format(self.token),
+      'x-frameio-client': "{}/{}".format(TELEMETRY_HEADERS['x-client-name'], TELEMETRY_HEADERS['x-client-version']),
+      **TELEMETRY_HEADERS
+    }
+
   def _get_version(self):
     try:
       from importlib import metadata
@@ -99,26 +176,42 @@ class FrameioClient(object):
 
     return metadata.version('frameioclient')
 
-  def _api_call(self, method, endpoint, payload={}, limit=None):
+  def _api_call(self, method, endpoint, payload={}, limit=None,
+                conditional=False):
+    """
+    With conditional, a GET is sent with the ETag or Last-Modified of its
+    previous response, and that result is reused if the API answers 304.
+    Only for endpoints without payload.
+    """
     url = '{}/v2{}'.format(self.host, endpoint)
-
-    headers = {
-      'Authorization': 'Bearer {}'.format(self.token),
-      'x-frameio-client': "{}/{}".format(TELEMETRY_HEADERS['x-client-name'], TELEMETRY_HEADERS['x-client-version']),
-      **TELEMETRY_HEADERS
-    }
-
-    adapter = HTTPAdapter(max_retries=self.retry_strategy)
-
-    http = requests.Session()
-    http.mount("https://", adapter)
-
-    r = http.request(
-      method,
-      url,
-      json=payload,
-      headers=headers,
-    )
+    category = rate_limiter.category(endpoint)
+
+    headers = dict(self.api_headers)
+    cached = None
+    if conditional:
+      with self.validators_lock:
+        cached = self.validators.get(url)
+      if cached is not None:
+        etag, last_modified, _ = cached
+        if etag:
+          headers['If-None-Match'] = etag
+        if last_modified:
+          headers['If-Modified-Since'] = last_modified
+
+    for _ in range(self.rate_limit_retries + 1):
+      rate_limiter.wait(category)
+      r = self.session.request(
+        method,
+        url,
+        json=payload,
+        headers=headers
+      )
+
+      if not rate_limiter.observe(category, r.status_code, r.headers):
+        break
+
+    if r.status_code == 304 and cached is not None:
+      return copy.deepcopy(cached[2])
 
     if r.ok:
       if r.headers.get('page-number'):
@@ -134,9 +227,17 @@ class FrameioClient(object):
             payload=payload,
             client=self
           )
-      if isinstance(r.json(), list):
-        return r.json()[:limit]
-      return r.json()
+      result = r.json()
+      if isinstance(result, list):
+        result = result[:limit]
+
+      etag = r.headers.get('ETag')
+      last_modified = r.headers.get('Last-Modified')
+      if conditional and (etag or last_modified):
+        with self.validators_lock:
+          self.validators[url] = (etag, last_modified, result)
+        return copy.deepcopy(result)
+      return result
 
     return r.raise_for_status()
 
@@ -155,7 +256,7 @@ class FrameioClient(object):
       return self._api_call(method, endpoint)
 
     if method == 'post':
-      payload['page'] = page
+      payload = dict(payload, page=page)  # Pages may be fetched at once
       return self._api_call(method, endpoint, payload=payload)
 
   def get_me(self):
@@ -193,7 +294,7 @@ class FrameioClient(object):
       account_id (string): The account id.
     """
     endpoint = '/teams'
-    return self._api_call('get', endpoint, kwargs)
+    return self._api_call('get', endpoint, kwargs, conditional=not kwargs)
 
   def get_projects(self, team_id, **kwargs):
     """
@@ -203,7 +304,7 @@ class FrameioClient(object):
       team_id (string): The team id.
     """
     endpoint = '/teams/{}/projects'.format(team_id)
-    return self._api_call('get', endpoint, kwargs)
+    return self._api_call('get', endpoint, kwargs, conditional=not kwargs)
 
   def get_shared_projects(self, **kwargs):
     """
@@ -220,7 +321,7 @@ class FrameioClient(object):
       project_id (string): the project's id
     """
     endpoint = '/projects/{}'.format(project_id)
-    return self._api_call('get', endpoint)
+    return self._api_call('get', endpoint, conditional=True)
   
   def get_collaborators(self, project_id, **kwargs):
     """
@@ -269,7 +370,7 @@ class FrameioClient(object):
       project_id (string): The project id.
     """
     endpoint = '/projects/{}'.format(project_id)
-    return self._api_call('get', endpoint)
+    return self._api_call('get', endpoint, conditional=True)
 
   def get_asset(self, asset_id):
     """
@@ -291,7 +392,8 @@ class FrameioClient(object):
     endpoint = '/assets/{}/children'.format(asset_id)
     return self._api_call('get', endpoint, kwargs)
 
-  def get_newest_assets(self, account_id, project_id, limit):
+  def get_newest_assets(self, account_id, project_id, limit,
+                        page_size=API_PAGE_SIZE):
     """
     Get project's most recently added assets.
 
@@ -299,11 +401,12 @@ class FrameioClient(object):
       account_id (string): The account id.
       project_id (string): The project id.
       limit (int): How many assets to get.
+      page_size (int): Assets per request.
     """
     payload = {
       "account_id": account_id,
       "page": 1,
-      "page_size": 50,
+      "page_size": page_size,
       "include": "children",
       "sort": "-inserted_at",
       "filter": {
@@ -316,7 +419,8 @@ class FrameioClient(object):
     endpoint = '/search/library'
     return self._api_call('post', endpoint, payload=payload, limit=limit)
 
-  def get_updated_assets(self, account_id, project_id, timestamp):
+  def get_updated_assets(self, account_id, project_id, timestamp,
+                         page_size=API_PAGE_SIZE):
     """
     Get assets added or updated since timestamp.
 
@@ -325,11 +429,12 @@ class FrameioClient(object):
       project_id (string): The project id.
       timestamp (string): ISO 8601 UTC format.
       (datetime.now(timezone.utc).isoformat())
+      page_size (int): Assets per request.
     """
     payload = {
       "account_id": account_id,
       "page": 1,
-      "page_size": 50,
+      "page_size": page_size,
       "include": "children",
       "sort": "-inserted_at",
       "filter": {
@@ -393,24 +498,30 @@ class FrameioClient(object):
     endpoint = '/assets/{}'.format(asset_id)
     return self._api_call('delete', endpoint)
 
-  def upload(self, asset, file):
+  def upload(self, asset, file, state=None):
     """
     Upload an asset. The method will exit once the file is uploaded.
+    Returns the file's xxh64, calculated from the uploaded chunks.
 
     :Args:
       asset (object): The asset object.
       file (file): The file to upload.
+      state (UploadState): Record of sent chunks, to resume an upload.
 
       Example::
 
         client.upload(asset, open('example.mp4')) // TODO fix this example (bad way of opening file)
     """
-    uploader = FrameioUploader(asset, file)
-    uploader.upload()
+    uploader = FrameioUploader(asset, file, state=state,
+                               buffers=upload_buffers,
+                               limiter=upload_limiter,
+                               rate_limiter=rate_limiter)
+    return uploader.upload()
   
   def download(self, asset, download_folder, replace=True):
     """
     Download an asset. The method will exit once the file is downloaded.
+    Returns the downloaded file's xxh64.
 
     :Args:
       asset (object): The asset object.
@@ -420,8 +531,13 @@ class FrameioClient(object):
 
         client.download(asset, "~./Downloads")
     """
-    downloader = FrameioDownloader(asset, download_folder, replace)
-    downloader.download()
+    downloader = FrameioDownloader(
+      asset, download_folder, replace, session=self.session,
+      chunk_size=DOWNLOAD_CHUNK_SIZE, part_size=DOWNLOAD_PART_SIZE,
+      parallel_parts=DOWNLOAD_PARTS_MAX,
+      multipart_min_size=DOWNLOAD_MULTIPART_MIN_SIZE,
+      limiter=download_limiter)
+    return downloader.download()
 
   def get_comment(self, comment_id, **kwargs):
     """
@@ -0,0 +1,137 @@
+import contextlib
+import threading
+import time
+
+THROTTLE_STATUSES = {429, 503}
+
+
+def throttled(response):
+  """
+  True if the response, or a retry urllib3 made on the way to it, was a
+  429 or 503.
+  """
+  if response.status_code in THROTTLE_STATUSES:
+    return True
+
+  retries = getattr(response.raw, 'retries', None)
+  history = getattr(retries, 'history', None) or ()
+  return any(h.status in THROTTLE_STATUSES for h in history)
+
+
+class Part(object):
+  def __init__(self):
+    self.bytes = 0
+    self.started = time.time()
+
+  def add(self, nbytes):
+    self.bytes += nbytes
+
+
+class AdaptiveLimiter(object):
+  """
+  Limit on transfer parts in flight, adjusted AIMD-style.
+
+  Once limit parts finished since the last adjustment, the limit is lowered
+  by one if per-byte latency went over latency_tolerance times the best
+  seen without throughput improving, as parts are then just queuing.
+  Otherwise it is raised by one unless throughput dropped.
+  A 429/503 response or connection error halves it, at most once per
+  cooldown secs since parts in flight tend to fail together.
+
+  Share one limiter between all transfers that use the same link.
+
+  :Args:
+    initial (int): Parts in flight to start with
+    min_limit (int): Lowest limit
+    max_limit (int): Highest limit
+    cooldown (float): Min secs between halvings
+    latency_tolerance (float): Latency over best seen that counts as queuing
+  """
+  def __init__(self, initial=4, min_limit=1, max_limit=16, cooldown=2,
+               latency_tolerance=1.5):
+    self.min_limit = min_limit
+    self.max_limit = max_limit
+    self.limit = max(min_limit, min(initial, max_limit))
+    self.cooldown = cooldown
+    self.latency_tolerance = latency_tolerance
+
+    self.in_flight = 0
+    self.cond = threading.Condition()
+    self.last_backoff = 0
+    self.best_latency = None  # Secs per byte
+    self.last_throughput = None
+    self._new_round()
+
+  def _new_round(self):
+    self.round_start = time.time()
+    self.round_parts = 0
+    self.round_bytes = 0
+    self.round_latency = 0
+
+  def _set_limit(self, limit):
+    self.limit = max(self.min_limit, min(limit, self.max_limit))
+    self.cond.notify_all()
+
+  @contextlib.contextmanager
+  def slot(self):
+    """
+    Wait for a free slot and hold it while sending or receiving a part.
+    Add transferred bytes to the yielded Part for them to be measured.
+    """
+    with self.cond:
+      self.cond.wait_for(lambda: self.in_flight < self.limit)
+      self.in_flight += 1
+
+    part = Part()
+    try:
+      yield part
+    finally:
+      with self.cond:
+        self.in_flight -= 1
+        self._record(part)
+        self.cond.notify()
+
+  def _record(self, part):
+    if not part.bytes:
+      return
+
+    latency = (time.time() - part.started) / part.bytes
+    if self.best_latency is None or latency < self.best_latency:
+      self.best_latency = latency
+
+    self.round_parts += 1
+    self.round_bytes += part.bytes
+    self.round_latency += latency
+    if self.round_parts < self.limit:
+      return
+
+    elapsed = max(time.time() - self.round_start, 1e-6)
+    throughput = self.round_bytes / elapsed
+    latency = self.round_latency / self.round_parts
+
+    if self.last_throughput is None:
+      self._set_limit(self.limit + 1)
+    elif throughput < self.last_throughput * 1.05 and \
+        latency > self.best_latency * self.latency_tolerance:
+      self._set_limit(self.limit - 1)
+    elif throughput >= self.last_throughput * 0.95:
+      self._set_limit(self.limit + 1)
+
+    self.last_throughput = throughput
+    self._new_round()
+
+  def backoff(self):
+    """Halve the limit after a throttled response or connection error."""
+    with self.cond:
+      now = time.time()
+      if now - self.last_backoff < self.cooldown:
+        return
+
+      self.last_backoff = now
+      self._set_limit(self.limit // 2)
+      self.last_throughput = None
+      self._new_round()
+
+  def stats(self):
+    with self.cond:
+      return {'limit': self.limit, 'in_flight': self.in_flight}
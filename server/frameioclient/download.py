@@ -1,29 +1,335 @@
+import concurrent.futures
+import json
 import os
+import threading
+import time
 import requests
+import xxhash
 from requests.adapters import HTTPAdapter
 from requests.packages.urllib3.util.retry import Retry
-from frameioclient.utils import calculate_hash
 from logger import logger
+from .concurrency import AdaptiveLimiter, THROTTLE_STATUSES, throttled
+
+http_retry_strategy = Retry(
+  total=3,
+  backoff_factor=1,
+  status_forcelist=[408, 500, 502, 503, 504],
+  method_whitelist=['GET']
+)
+
+
+
+class Throttled(requests.exceptions.RequestException):
+  pass
+
+
+PART_ERRORS = (
+  requests.exceptions.ChunkedEncodingError,
+  requests.exceptions.ConnectionError,
+  requests.exceptions.Timeout,
+  Throttled
+)
+
+PART_SUFFIX = '.fio-part'
+MANIFEST_SUFFIX = '.fio-part.json'
+
+fdatasync = getattr(os, 'fdatasync', os.fsync)
+
+
+class RangeNotSupported(Exception):
+  pass
+
+
+class PartManifest(object):
+  """
+  Sidecar file recording how far each part of a download got, so an
+  interrupted download continues where it stopped.
+
+  Progress is kept as {part start: next missing offset}. part_size is 0 for
+  a single stream download. The manifest is only reused for the same asset,
+  size, checksum and part_size.
+  """
+  def __init__(self, path, asset_id, size, checksum, part_size,
+               save_interval=1):
+    self.path = path
+    self.key = {'asset_id': asset_id, 'size': size, 'checksum': checksum,
+                'part_size': part_size}
+    self.progress = {}
+    self.save_interval = save_interval
+    self.last_save = 0
+    self.lock = threading.Lock()
+    self.save_lock = threading.Lock()
+
+  @property
+  def part_size(self):
+    return self.key['part_size']
+
+  def load(self):
+    """Load saved progress. Returns False if missing or for other data."""
+    try:
+      with open(self.path) as f:
+        data = json.load(f)
+    except (OSError, ValueError):
+      return False
+
+    if data.get('key') != self.key:
+      return False
+
+    self.progress = {int(start): offset
+                     for start, offset in data['progress'].items()}
+    return True
+
+  def reset(self, part_size):
+    with self.lock:
+      self.key['part_size'] = part_size
+      self.progress = {}
+
+  def resume_offset(self, start):
+    with self.lock:
+      return self.progress.get(start, start)
+
+  def advance(self, start, offset):
+    with self.lock:
+      self.progress[start] = offset
+
+  def save(self, fd, force=True):
+    """Write manifest, after syncing the data it describes to disk."""
+    if not force and time.time() - self.last_save < self.save_interval:
+      return
+
+    with self.save_lock:
+      with self.lock:
+        data = {'key': self.key, 'progress': self.progress.copy()}
+        self.last_save = time.time()
+
+      fdatasync(fd)
+      tmp_path = self.path + '.tmp'
+      with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+      os.replace(tmp_path, self.path)
+
+  def delete(self):
+    try:
+      os.remove(self.path)
+    except FileNotFoundError:
+      pass
+
+
+class OrderedHasher(object):
+  """
+  xxh64 of a file whose parts finish out of order. Each part is hashed as
+  soon as all parts before it are done, reading it back with pread while
+  it's normally still in the page cache.
+  """
+  def __init__(self, fd, parts, block_size):
+    self.fd = fd
+    self.parts = parts
+    self.block_size = block_size
+    self.xxh64_hash = xxhash.xxh64()
+    self.done = set()
+    self.next_index = 0
+    self.lock = threading.Lock()
+
+  def part_done(self, index):
+    with self.lock:
+      self.done.add(index)
+      while self.next_index in self.done:
+        start, end = self.parts[self.next_index]
+        offset = start
+        while offset <= end:
+          data = os.pread(self.fd, min(self.block_size, end - offset + 1),
+                          offset)
+          if not data:
+            break
+          self.xxh64_hash.update(data)
+          offset += len(data)
+
+        self.next_index += 1
+
+  def hexdigest(self):
+    return self.xxh64_hash.hexdigest()
 
 
 class FrameioDownloader(object):
-  def __init__(self, asset, download_folder, replace):
+  """
+  Download an asset, verified against its Frame.io xxh64.
+
+  Data is written to a hidden .fio-part file next to the destination, with
+  a manifest of the byte ranges written so far. Retries and later runs
+  continue from there, and the file is moved into place once complete.
+
+  Assets of at least multipart_min_size are split into part_size HTTP Range
+  requests, fetched in parallel straight into a preallocated file. A failed
+  part is retried from where it stopped. Parts in flight are limited by
+  limiter, by default to parallel_parts for this download.
+  """
+  def __init__(self, asset, download_folder, replace, session=None,
+               chunk_size=1048576, part_size=67108864, parallel_parts=4,
+               multipart_min_size=134217728, limiter=None):
     self.asset = asset
     self.download_folder = download_folder
     self.replace = replace
+    self.session = session
     self.attempts = 0
     self.retry_limit = 3
 
-    self.http_retry_strategy = Retry(
-      total=3,
-      backoff_factor=1,
-      status_forcelist=[408, 500, 502, 503, 504],
-      method_whitelist=['GET']
-    )
+    self.chunk_size = chunk_size
+    self.part_size = part_size
+    self.parallel_parts = parallel_parts
+    self.multipart_min_size = multipart_min_size
+    self.part_retry_limit = 3
+    self.stop = threading.Event()
+    self.limiter = limiter or AdaptiveLimiter(initial=parallel_parts,
+                                              max_limit=parallel_parts)
+
+  def _download_single(self, http, url, fd, manifest, size=0):
+    """Stream file in one request and return its xxh64."""
+    offset = manifest.resume_offset(0)
+    if size and offset > size:
+      offset = size
+    xxh64_hash = xxhash.xxh64()
+    headers = {}
+
+    if offset:
+      os.lseek(fd, 0, os.SEEK_SET)
+      remaining = offset
+      while remaining:
+        data = os.read(fd, min(self.chunk_size, remaining))
+        if not data:
+          break
+        xxh64_hash.update(data)
+        remaining -= len(data)
+      offset -= remaining
+      headers['Range'] = 'bytes={}-'.format(offset)
+
+      # Stopped before the part file was renamed, only verify it
+      if size and offset == size:
+        os.ftruncate(fd, size)
+        return xxh64_hash.hexdigest()
+
+    with self.limiter.slot() as part:
+      r = http.request('GET', url, stream=True, headers=headers)
+      if offset and r.status_code == 416:  # Part file doesn't fit, restart
+        r.close()
+        offset = 0
+        xxh64_hash = xxhash.xxh64()
+        manifest.reset(0)
+        r = http.request('GET', url, stream=True)
+      if throttled(r):
+        self.limiter.backoff()
+      r.raise_for_status()
+
+      if offset and r.status_code != 206:  # Range ignored, start over
+        offset = 0
+        xxh64_hash = xxhash.xxh64()
+        manifest.reset(0)
+
+      os.ftruncate(fd, offset)
+      os.lseek(fd, offset, os.SEEK_SET)
+
+      try:
+        for chunk in r.iter_content(chunk_size=self.chunk_size):
+          if chunk:
+            os.write(fd, chunk)
+            xxh64_hash.update(chunk)
+            offset += len(chunk)
+            part.add(len(chunk))
+            manifest.advance(0, offset)
+            manifest.save(fd, force=False)
+      finally:
+        manifest.save(fd)
+
+    return xxh64_hash.hexdigest()
+
+  def _download_part(self, http, url, fd, index, start, end, hasher,
+                     manifest):
+    offset = manifest.resume_offset(start)
+    retries = 0
+
+    while offset <= end:
+      try:
+        with self.limiter.slot() as part:
+          r = http.request('GET', url, stream=True, headers={
+            'Range': 'bytes={}-{}'.format(offset, end)
+          })
+          if throttled(r):
+            self.limiter.backoff()
+          if r.status_code in THROTTLE_STATUSES:
+            r.close()
+            raise Throttled('{} for part {}'.format(r.status_code, index))
+          if r.status_code == 200:  # Range ignored, whole file is coming
+            r.close()
+            raise RangeNotSupported
+          r.raise_for_status()
+
+          for chunk in r.iter_content(chunk_size=self.chunk_size):
+            if self.stop.is_set():
+              r.close()
+              return
+            chunk = chunk[:end - offset + 1]
+            os.pwrite(fd, chunk, offset)
+            offset += len(chunk)
+            part.add(len(chunk))
+            manifest.advance(start, offset)
+            manifest.save(fd, force=False)
+
+        if offset <= end:
+          raise requests.exceptions.ChunkedEncodingError(
+            'Part ended at {} of {}'.format(offset, end))
+
+      except PART_ERRORS as e:
+        retries += 1
+        if retries > self.part_retry_limit:
+          raise
+        logger.info('Download part {} failed, retrying: {}'.format(index, e))
+        if isinstance(e, Throttled):
+          time.sleep(retries)
+        else:
+          self.limiter.backoff()
+
+    hasher.part_done(index)
+
+  def _download_multipart(self, http, url, fd, manifest, size):
+    """Fetch file in parallel ranges and return its xxh64."""
+    parts = [(start, min(start + manifest.part_size, size) - 1)
+             for start in range(0, size, manifest.part_size)]
+
+    if hasattr(os, 'posix_fallocate'):
+      os.posix_fallocate(fd, 0, size)
+    elif os.fstat(fd).st_size < size:
+      os.ftruncate(fd, size)
+
+    hasher = OrderedHasher(fd, parts, self.chunk_size)
+    self.stop.clear()
+
+    try:
+      with concurrent.futures.ThreadPoolExecutor(
+          max_workers=self.limiter.max_limit) as executor:
+        futures = [executor.submit(self._download_part, http, url, fd, index,
+                                   start, end, hasher, manifest)
+                   for index, (start, end) in enumerate(parts)]
+        try:
+          for future in concurrent.futures.as_completed(futures):
+            future.result()
+        except BaseException:
+          self.stop.set()  # Let running parts exit early
+          for future in futures:
+            future.cancel()
+          raise
+    finally:
+      manifest.save(fd)
+
+    return hasher.hexdigest()
 
   def download(self):
+    """
+    Download asset and return xxh64 of the written file, calculated while
+    downloading so the file doesn't have to be read back from disk.
+    """
     original_filename = self.asset['name']
     final_destination = os.path.join(self.download_folder, original_filename)
+    part_path = os.path.join(self.download_folder,
+                             '.' + original_filename + PART_SUFFIX)
 
     if os.path.isfile(final_destination) and not self.replace:
       try:
@@ -31,9 +337,10 @@ class FrameioDownloader(object):
       except NameError:
         raise OSError('File exists')  # Python < 3.3
 
-    adapter = HTTPAdapter(max_retries=self.http_retry_strategy)
-    http = requests.Session()
-    http.mount('https://', adapter)
+    http = self.session
+    if http is None:
+      http = requests.Session()
+      http.mount('https://', HTTPAdapter(max_retries=http_retry_strategy))
 
     url = self.asset['original']
 
@@ -42,25 +349,68 @@ class FrameioDownloader(object):
     except (TypeError, KeyError):
       original_checksum = None
 
-    while self.attempts < self.retry_limit:
-      r = http.request('GET', url, stream=True)
+    size = self.asset.get('filesize') or 0
+    multipart = (self.parallel_parts > 1 and hasattr(os, 'pwrite') and
+                 size >= self.multipart_min_size)
+
+    manifest = PartManifest(
+      os.path.join(self.download_folder,
+                   '.' + original_filename + MANIFEST_SUFFIX),
+      self.asset['id'], size, original_checksum,
+      self.part_size if multipart else 0)
+
+    fd = os.open(part_path, os.O_RDWR | os.O_CREAT, 0o666)
+    try:
+      if manifest.load():
+        logger.info('Resuming download of {}'.format(original_filename))
+      else:
+        os.ftruncate(fd, 0)
 
-      with open(final_destination, 'wb') as handle:
+      file_hash = None
+      while True:
         try:
-          for chunk in r.iter_content(chunk_size=4096):
-            if chunk:
-              handle.write(chunk)
-        except requests.exceptions.ChunkedEncodingError:
+          if multipart:
+            file_hash = self._download_multipart(http, url, fd, manifest,
+                                                 size)
+          else:
+            file_hash = self._download_single(http, url, fd, manifest,
+                                              size)
+        except RangeNotSupported:
+          logger.info('Ranged download not supported, using single stream')
+          multipart = False
+          manifest.reset(0)
+          os.ftruncate(fd, 0)
+          manifest.save(fd)
+          continue
+        except PART_ERRORS:
           self.attempts += 1
+          if self.attempts >= self.retry_limit:
+            raise  # Part file is kept, next run resumes it
+          logger.info('Download interrupted, resuming')
           continue
 
-      if not original_checksum:
-        logger.info('No original checksum found, skipping verification')
-        break
+        if not original_checksum:
+          logger.info('No original checksum found, skipping verification')
+          break
+
+        if file_hash == original_checksum:
+          logger.info('Download succeeded')
+          break
+
+        self.attempts += 1
+        if self.attempts >= self.retry_limit:
+          logger.info('Download failed, hash mismatch')
+          break
 
-      if calculate_hash(final_destination) == original_checksum:
-        logger.info('Download succeeded')
-        break
+        # Whole file is only verified at the end, no way to tell which
+        # range was bad.
+        logger.info('Download failed, retrying')
+        manifest.reset(manifest.part_size)
+        os.ftruncate(fd, 0)
+        manifest.save(fd)
+    finally:
+      os.close(fd)
 
-      logger.info('Download failed, retrying')
-      self.attempts += 1
+    os.replace(part_path, final_destination)
+    manifest.delete()
+    return file_hash
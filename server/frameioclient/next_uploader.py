@@ -1,18 +1,211 @@
+import contextlib
+import json
 import math
 import requests
 import threading
 import concurrent.futures
 import os
-import psutil
+import time
+import xxhash
+
+from .concurrency import AdaptiveLimiter, throttled
 
 thread_local = threading.local()
 
+RETRY_STATUSES = {408, 429, 500, 502, 503, 504}
+
+
+class ChunkReadError(Exception):
+    """Chunk couldn't be read, usually as the file changed or was removed."""
+
+
+class BufferPool(object):
+    """Read buffers shared by all uploads, so the chunk data they hold in
+    memory never exceeds budget bytes. Buffers are allocated on first use.
+
+    :Args:
+    budget (int): Total bytes of all buffers
+    buffer_size (int): Bytes per buffer
+    """
+
+    def __init__(self, budget, buffer_size):
+        self.buffer_size = buffer_size
+        self.count = max(1, budget // buffer_size)
+        self.created = 0
+        self.free = []
+        self.available = threading.Condition()
+
+    @contextlib.contextmanager
+    def buffer(self):
+        """Borrow a buffer, waiting for one if all are in use."""
+        with self.available:
+            self.available.wait_for(
+                lambda: self.free or self.created < self.count)
+            if self.free:
+                buf = self.free.pop()
+            else:
+                buf = bytearray(self.buffer_size)
+                self.created += 1
+
+        try:
+            yield memoryview(buf)
+        finally:
+            with self.available:
+                self.free.append(buf)
+                self.available.notify()
+
+
+class FileSlice(object):
+    """Read-only file-like view of length bytes at offset, used as request
+    body. Each read refills one pooled buffer and returns a memoryview of
+    it, so the chunk is sent without being held in memory or copied.
+
+    read() returns up to a whole buffer regardless of the size asked for,
+    which saves a send call per 8 KB block in http.client.
+    """
+
+    def __init__(self, path, offset, length, buffer):
+        try:
+            self.file = open(path, 'rb')
+            self.file.seek(offset)
+        except OSError as e:
+            raise ChunkReadError(e)
+
+        self.length = length
+        self.remaining = length
+        self.buffer = buffer
+
+    def __len__(self):
+        return self.length
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b''
+
+        try:
+            read = self.file.readinto(
+                self.buffer[:min(len(self.buffer), self.remaining)])
+        except OSError as e:
+            raise ChunkReadError(e)
+
+        if not read:
+            raise ChunkReadError('File ended {} bytes early'.format(
+                self.remaining))
+
+        self.remaining -= read
+        return self.buffer[:read]
+
+    def close(self):
+        self.file.close()
+
+
+class UploadState(object):
+    """Record of the chunks of an upload that were sent, so an interrupted
+    upload can continue with the rest.
+
+    The first line of the file is a JSON header with the asset's upload
+    urls and the local file's size and mtime. Each sent chunk's index is
+    appended as its own line after that.
+    """
+
+    def __init__(self, path, header):
+        self.path = path
+        self.header = header
+        self.done = set()
+        self.lock = threading.Lock()
+
+    @classmethod
+    def create(cls, path, asset, file_stat):
+        header = {'asset_id': asset['id'],
+                  'filesize': asset['filesize'],
+                  'filetype': asset['filetype'],
+                  'upload_urls': asset['upload_urls'],
+                  'mtime_ns': file_stat.st_mtime_ns}
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            f.write(json.dumps(header) + '\n')
+
+        return cls(path, header)
+
+    @classmethod
+    def load(cls, path, asset_id, file_stat):
+        """Return saved state, or None if missing or the file changed."""
+        try:
+            with open(path) as f:
+                header = json.loads(f.readline())
+                done = {int(line) for line in f if line.strip().isdigit()}
+        except (OSError, ValueError):
+            return None
+
+        if header.get('asset_id') != asset_id or \
+                header.get('filesize') != file_stat.st_size or \
+                header.get('mtime_ns') != file_stat.st_mtime_ns:
+            return None
+
+        state = cls(path, header)
+        state.done = done
+        return state
+
+    @property
+    def asset(self):
+        return {'id': self.header['asset_id'],
+                'filesize': self.header['filesize'],
+                'filetype': self.header['filetype'],
+                'upload_urls': self.header['upload_urls']}
+
+    def chunk_done(self, index):
+        with self.lock:
+            self.done.add(index)
+            with open(self.path, 'a') as f:
+                f.write('{}\n'.format(index))
+
+    def delete(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
 
 class FrameioUploader(object):
-    def __init__(self, asset, file):
+    """Upload file to the asset's upload_urls.
+
+    Chunks are streamed from the file through buffers borrowed from
+    buffers. Failed chunks are retried with exponential backoff. With a
+    state, sent chunks are recorded there and chunks already in it are
+    only hashed.
+
+    :Args:
+    asset (dict): Frame.io asset with upload_urls
+    file (file): File to upload
+    state (UploadState): Optional record of sent chunks
+    buffers (BufferPool): Shared buffers, defaults to 5 MB for this upload
+    limiter (AdaptiveLimiter): Shared limit on chunks in flight, defaults
+      to 5 for this upload
+    rate_limiter (RateLimiter): Optional, chunks use its 'uploads' budget
+    """
+
+    def __init__(self, asset, file, state=None, buffers=None, limiter=None,
+                 rate_limiter=None, chunk_retries=5, backoff_factor=1):
         self.asset = asset
-        self.file = file
+        self.path = os.path.realpath(file.name)
+        self.state = state
+        self.buffers = buffers or BufferPool(5242880, 1048576)
+        self.limiter = limiter or AdaptiveLimiter(initial=5, max_limit=5)
+        self.rate_limiter = rate_limiter
         self.chunk_size = None
+        self.chunk_retries = chunk_retries
+        self.backoff_factor = backoff_factor
+
+        # Sent chunks are hashed in order, reading them back while they're
+        # normally still in the page cache.
+        self.chunks = []  # (offset, length)
+        self.xxh64_hash = xxhash.xxh64()
+        self.hash_ok = True
+        self.sent = set()
+        self.next_hash_index = 0
+        self.hashing = False
+        self.hash_lock = threading.Lock()
 
     def _calculate_chunks(self, total_size, chunk_count):
         self.chunk_size = int(math.ceil(total_size / chunk_count))
@@ -30,46 +223,139 @@ class FrameioUploader(object):
             thread_local.session = requests.Session()
         return thread_local.session
 
-    def _smart_read_chunk(self, chunk_offset):
-        with open(os.path.realpath(self.file.name), "rb") as file:
-            file.seek(chunk_offset, 0)
-            data = file.read(self.chunk_size)
-            return data
+    def _hash_chunk(self, index):
+        offset, length = self.chunks[index]
+        try:
+            with self.buffers.buffer() as buf:
+                chunk = FileSlice(self.path, offset, length, buf)
+                try:
+                    data = chunk.read()
+                    while data:
+                        self.xxh64_hash.update(data)
+                        data = chunk.read()
+                finally:
+                    chunk.close()
+        except ChunkReadError:
+            self.hash_ok = False
+
+    def _chunk_sent(self, index):
+        """Hash chunks that are sent along with all chunks before them.
+        Only one thread hashes at a time, others just add their chunk.
+        """
+        with self.hash_lock:
+            self.sent.add(index)
+            if self.hashing:
+                return
+            self.hashing = True
+
+        while True:
+            with self.hash_lock:
+                if self.next_hash_index not in self.sent:
+                    self.hashing = False
+                    return
+
+            self._hash_chunk(self.next_hash_index)
+            with self.hash_lock:
+                self.next_hash_index += 1
+
+    def _put_chunk(self, url, offset, length):
+        """PUT chunk, retrying connection errors and retryable statuses."""
+        session = self._get_session()
+        attempt = 0
+        while True:
+            if self.rate_limiter is not None:
+                self.rate_limiter.wait('uploads')
+
+            try:
+                with self.limiter.slot() as part, \
+                        self.buffers.buffer() as buf:
+                    chunk = FileSlice(self.path, offset, length, buf)
+                    try:
+                        r = session.put(url, data=chunk, headers={
+                            'content-type': self.asset['filetype'],
+                            'x-amz-acl': 'private'
+                        })
+                    finally:
+                        chunk.close()
+
+                    if r.ok:
+                        part.add(length)
+
+                if throttled(r):
+                    self.limiter.backoff()
+
+                # A paused bucket already makes the retry wait Retry-After
+                paused = self.rate_limiter is not None and \
+                    self.rate_limiter.observe('uploads', r.status_code,
+                                              r.headers)
+
+                if not paused and r.status_code not in RETRY_STATUSES:
+                    r.raise_for_status()
+                    return
+                error = requests.exceptions.HTTPError(
+                    '{} Error for url: {}'.format(r.status_code, url),
+                    response=r)
+
+            except (requests.exceptions.ConnectionError,
+                    requests.exceptions.Timeout) as e:
+                self.limiter.backoff()
+                paused = False
+                error = e
+
+            attempt += 1
+            if attempt > self.chunk_retries:
+                raise error
+
+            if not paused:
+                time.sleep(self.backoff_factor * (2 ** (attempt - 1)))
 
     def _upload_chunk(self, task):
         url = task[0]
         chunk_offset = task[1]
+        index = task[2]
 
-        session = self._get_session()
-        chunk_data = self._smart_read_chunk(chunk_offset)
+        if self.state is None or index not in self.state.done:
+            try:
+                self._put_chunk(url, chunk_offset, self.chunks[index][1])
+            except ChunkReadError:
+                self.hash_ok = False  # Upload returns None for the hash
+                return
 
-        try:
-            session.put(url, data=chunk_data, headers={
-                'content-type': self.asset['filetype'],
-                'x-amz-acl': 'private'
-            })
-        except Exception as e:
-            print(e)
+            if self.state is not None:
+                self.state.chunk_done(index)
+
+        self._chunk_sent(index)
 
     def upload(self):
+        """Upload file and return its xxh64, or None if a chunk couldn't
+        be read. Raises the first error of chunks that couldn't be sent
+        after retrying, once the other chunks are done.
+        """
         total_size = self.asset['filesize']
         upload_urls = self.asset['upload_urls']
 
         chunk_offsets = self._calculate_chunks(total_size,
                                                chunk_count=len(upload_urls))
+        self.chunks = [(offset, max(0, min(self.chunk_size,
+                                           total_size - offset)))
+                       for offset in chunk_offsets]
+
+        tasks = [(upload_urls[i], chunk_offsets[i], i)
+                 for i in range(len(upload_urls))]
+
+        workers = max(1, min(len(tasks), self.limiter.max_limit))
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=workers) as executor:
+            futures = [executor.submit(self._upload_chunk, task)
+                       for task in tasks]
+        errors = [f.exception() for f in futures if f.exception()]
+
+        if errors:
+            raise errors[0]
+
+        if not self.hash_ok:
+            return None
 
-        if psutil.virtual_memory().available < 3000000000:  # < 3GB
-            for i in range(len(upload_urls)):
-                url = upload_urls[i]
-                chunk_offset = chunk_offsets[i]
-
-                task = (url, chunk_offset)
-                self._upload_chunk(task)
-        else:
-            with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
-                for i in range(len(upload_urls)):
-                    url = upload_urls[i]
-                    chunk_offset = chunk_offsets[i]
-
-                    task = (url, chunk_offset)
-                    executor.submit(self._upload_chunk, task)
\ No newline at end of file
+        if self.state is not None:
+            self.state.delete()
+        return self.xxh64_hash.hexdigest()
@@ -0,0 +1,155 @@
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+DEFAULT_PAUSE = 1  # Secs to pause a bucket on 429 without Retry-After
+
+
+def retry_after(headers):
+  """Return secs to wait from a Retry-After header, or None."""
+  value = headers.get('Retry-After')
+  if not value:
+    return None
+
+  try:
+    return max(0, float(value))
+  except ValueError:
+    pass
+
+  try:
+    when = parsedate_to_datetime(value)
+  except (TypeError, ValueError):
+    return None
+  return max(0, (when - datetime.now(timezone.utc)).total_seconds())
+
+
+class TokenBucket(object):
+  """
+  Allows rate requests per sec, with bursts of up to capacity. Callers
+  reserve a token and wait the returned delay, so waiting callers are
+  served in order instead of polling.
+
+  :Args:
+    rate (float): Tokens added per sec
+    capacity (int): Max tokens
+  """
+  def __init__(self, rate, capacity):
+    self.rate = float(rate)
+    self.capacity = capacity
+    self.tokens = float(capacity)
+    self.updated = time.monotonic()  # In the future while paused
+    self.throttled = 0
+    self.lock = threading.Lock()
+
+  def _refill(self, now):
+    if now > self.updated:
+      self.tokens = min(self.capacity,
+                        self.tokens + (now - self.updated) * self.rate)
+      self.updated = now
+
+  def reserve(self):
+    """Take a token and return secs to wait before using it."""
+    with self.lock:
+      now = time.monotonic()
+      self._refill(now)
+      self.tokens -= 1
+      ready_at = self.updated + max(0, -self.tokens) / self.rate
+      return max(0, ready_at - now)
+
+  def pause(self, secs):
+    """Hand out no tokens for secs, then refill from empty."""
+    with self.lock:
+      now = time.monotonic()
+      self._refill(now)
+      self.throttled += 1
+      self.updated = max(self.updated, now + secs)
+      self.tokens = min(self.tokens, 0)
+
+  def update(self, limit, remaining, window):
+    """Follow the rate-limit headers of a response.
+
+    :Args:
+      limit (int): Requests allowed per window
+      remaining (int): Requests left in the current window
+      window (float): Window length in secs
+    """
+    with self.lock:
+      if limit and window:
+        self.rate = limit / float(window)
+        self.capacity = limit
+      self._refill(time.monotonic())
+      self.tokens = min(self.tokens, remaining)
+
+  def stats(self):
+    with self.lock:
+      now = time.monotonic()
+      self._refill(now)
+      return {
+        'rate': round(self.rate, 2),
+        'capacity': self.capacity,
+        'tokens': round(self.tokens, 2),
+        'headroom': round(max(0, self.tokens) / self.capacity, 2),
+        'paused': round(max(0, self.updated - now), 2),
+        'throttled': self.throttled
+      }
+
+
+class RateLimiter(object):
+  """
+  Token buckets per request category, shared by all clients so the
+  budgets hold across threads. Buckets pause on 429 for Retry-After secs,
+  and follow x-ratelimit-* headers when the API sends them.
+
+  :Args:
+    limits (dict): Category -> (requests per sec, burst). Needs 'default'.
+  """
+  def __init__(self, limits):
+    self.buckets = {category: TokenBucket(rate, burst)
+                    for category, (rate, burst) in limits.items()}
+
+  @staticmethod
+  def category(endpoint):
+    """Category of an API endpoint, like '/search/library'."""
+    if endpoint.startswith('/search'):
+      return 'search'
+    if endpoint.startswith('/assets'):
+      return 'assets'
+    return 'default'
+
+  def bucket(self, category):
+    return self.buckets.get(category, self.buckets['default'])
+
+  def reserve(self, category):
+    """Take a token and return secs to wait, for use with asyncio."""
+    return self.bucket(category).reserve()
+
+  def wait(self, category):
+    delay = self.reserve(category)
+    if delay:
+      time.sleep(delay)
+
+  def observe(self, category, status_code, headers):
+    """Adjust bucket to a response. Returns True if it was throttled."""
+    bucket = self.bucket(category)
+
+    remaining = headers.get('x-ratelimit-remaining')
+    if remaining is not None:
+      try:
+        window = headers.get('x-ratelimit-window')
+        limit = headers.get('x-ratelimit-limit')
+        bucket.update(int(limit) if limit else None, int(remaining),
+                      int(window) / 1000.0 if window else None)  # ms
+      except ValueError:
+        pass
+
+    wait = retry_after(headers)
+    if status_code == 429 or (status_code == 503 and wait is not None):
+      bucket.pause(DEFAULT_PAUSE if wait is None else wait)
+      return True
+
+    return False
+
+  def stats(self):
+    return {category: bucket.stats()
+            for category, bucket in self.buckets.items()}
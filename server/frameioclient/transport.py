@@ -0,0 +1,68 @@
+import socket
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.connection import HTTPConnection
+
+
+class KeepAliveAdapter(HTTPAdapter):
+  """
+  HTTPAdapter that turns on TCP keep-alive for pooled connections, so idle
+  sockets survive between sync loops instead of being dropped by NATs and
+  load balancers.
+  """
+  def __init__(self, keepalive_idle=60, **kwargs):
+    self.keepalive_idle = keepalive_idle  # Set before the pool is created
+    super().__init__(**kwargs)
+
+  def _socket_options(self):
+    options = HTTPConnection.default_socket_options + [
+      (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    ]
+
+    if hasattr(socket, 'TCP_KEEPIDLE'):  # Linux
+      options += [
+        (socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, self.keepalive_idle),
+        (socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, 10),
+        (socket.IPPROTO_TCP, socket.TCP_KEEPCNT, 3)
+      ]
+    elif hasattr(socket, 'TCP_KEEPALIVE'):  # macOS
+      options.append(
+        (socket.IPPROTO_TCP, socket.TCP_KEEPALIVE, self.keepalive_idle))
+
+    return options
+
+  def init_poolmanager(self, *args, **kwargs):
+    kwargs['socket_options'] = self._socket_options()
+    super().init_poolmanager(*args, **kwargs)
+
+
+def create_session(retry_strategies, pool_connections=10, pool_maxsize=10,
+                   keepalive_idle=60):
+  """
+  Create a long-lived session with pooled keep-alive connections. It is safe
+  to share between threads.
+
+  :Args:
+    retry_strategies (dict): URL prefix -> Retry. The longest matching prefix
+      is used, so API and download hosts can retry on different statuses.
+    pool_connections (int): Number of hosts to keep pools for
+    pool_maxsize (int): Max connections kept per host
+    keepalive_idle (int): Seconds before TCP keep-alive probes start
+
+    Example::
+
+      create_session({'https://': download_retry,
+                      'https://api.frame.io': api_retry})
+  """
+  session = requests.Session()
+
+  for prefix, retry_strategy in retry_strategies.items():
+    session.mount(prefix, KeepAliveAdapter(
+      keepalive_idle=keepalive_idle,
+      max_retries=retry_strategy,
+      pool_connections=pool_connections,
+      pool_maxsize=pool_maxsize
+    ))
+
+  return session
@@ -1,4 +1,3 @@
-import xxhash
 import sys
 
 KB = 1024
@@ -42,24 +41,6 @@ def format_bytes(size):
     return " ".join((str(round(size, 2)), power_labels[n]))
 
 
-def calculate_hash(file_path):
-    """
-    Calculate an xx64hash
-    """
-    xxh64_hash = xxhash.xxh64()
-    b = bytearray(MB * 8)
-    f = open(file_path, "rb")
-    while True:
-        numread = f.readinto(b)
-        if not numread:
-            break
-        xxh64_hash.update(b[:numread])
-
-    xxh64_digest = xxh64_hash.hexdigest()
-
-    return xxh64_digest
-
-
 def compare_items(dict1, dict2):
     """
     Python 2 and 3 compatible way of comparing 2x dictionaries
@@ -0,0 +1,121 @@
+import os
+from collections import OrderedDict
+from threading import Lock
+from time import time, sleep
+
+from peewee import SqliteDatabase, OperationalError
+
+import config
+from db_models import init_hash_model
+from logger import logger
+
+DB_LOCKED_RETRIES = 20  # Waits of 0.5 secs for the DB write lock
+
+
+class HashCache:
+    """Persistent cache of xxh64 hashes for local files.
+
+    A cached hash is returned while the file's size, mtime and inode are
+    unchanged and it is younger than ttl. The most recently used entries are
+    kept in memory, the rest are looked up in hash_cache.db.
+
+    :Args:
+    db_path (path): SQLite file to persist hashes in
+    max_entries (int): Max entries kept in memory
+    ttl (int): Secs before a hash is calculated again
+    """
+
+    def __init__(self, db_path, max_entries, ttl):
+        self.db = SqliteDatabase(db_path, pragmas={'journal_mode': 'wal'})
+        self.FileHash = init_hash_model(self.db)
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()  # path -> (size, mtime, inode, hash, at)
+        self.lock = Lock()
+
+        self.FileHash.delete().where(
+            self.FileHash.hashed_at < time() - self.ttl).execute()
+        self.db.close()
+
+    @staticmethod
+    def _key(file_stat):
+        return file_stat.st_size, file_stat.st_mtime_ns, file_stat.st_ino
+
+    def _remember(self, path, entry):
+        with self.lock:
+            self.entries[path] = entry
+            self.entries.move_to_end(path)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def lookup(self, path, file_stat=None):
+        """Return cached hash if still valid for the file, else None."""
+        if file_stat is None:
+            file_stat = os.stat(path)
+
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is not None:
+                self.entries.move_to_end(path)
+
+        if entry is None:
+            row = self.FileHash.get_or_none(self.FileHash.path == path)
+            self.db.close()
+            if row is None:
+                return None
+
+            entry = (row.size, row.mtime_ns, row.inode, row.xxhash,
+                     row.hashed_at)
+            self._remember(path, entry)
+
+        if entry[:3] != self._key(file_stat) or time() - entry[4] > self.ttl:
+            return None
+
+        return entry[3]
+
+    def store(self, path, file_hash, file_stat=None):
+        """Save hash for file as it is on disk now."""
+        if file_stat is None:
+            file_stat = os.stat(path)
+
+        entry = self._key(file_stat) + (file_hash, int(time()))
+        self._remember(path, entry)
+
+        # Wait for DB write lock from other threads. Other errors only lose
+        # the cached hash, the file is hashed again when needed.
+        for attempt in range(DB_LOCKED_RETRIES + 1):
+            try:
+                self.FileHash.insert(
+                    path=path, size=entry[0], mtime_ns=entry[1],
+                    inode=entry[2], xxhash=file_hash,
+                    hashed_at=entry[4]).on_conflict_replace().execute()
+                break
+            except OperationalError as e:
+                if 'locked' not in str(e) or attempt == DB_LOCKED_RETRIES:
+                    logger.info("Couldn't save hash of {}: {}".format(path,
+                                                                      e))
+                    break
+                sleep(0.5)
+
+        self.db.close()
+
+    def invalidate(self, path):
+        """Forget the hash of one file, so it's hashed again."""
+        with self.lock:
+            self.entries.pop(path, None)
+
+        self.FileHash.delete().where(self.FileHash.path == path).execute()
+        self.db.close()
+
+    def clear(self):
+        """Forget all hashes, forcing files to be hashed again."""
+        with self.lock:
+            self.entries.clear()
+
+        self.FileHash.delete().execute()
+        self.db.close()
+
+
+hash_cache = HashCache(os.path.join(config.DB_FOLDER, 'hash_cache.db'),
+                       max_entries=config.HASH_CACHE_SIZE,
+                       ttl=config.HASH_CACHE_TTL)
@@ -0,0 +1,153 @@
+import fnmatch
+import os
+import re
+
+from peewee import fn
+
+WILDCARDS = re.compile(r'[*?[]')
+
+
+def translate_path(pattern):
+    """Regex for a path pattern. Wildcards don't match '/', except '**'
+    which matches across folders.
+    """
+    parts = []
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith('**/', i):
+            parts.append('(?:.*/)?')
+            i += 3
+        elif pattern.startswith('**', i):
+            parts.append('.*')
+            i += 2
+        elif pattern[i] == '*':
+            parts.append('[^/]*')
+            i += 1
+        elif pattern[i] == '?':
+            parts.append('[^/]')
+            i += 1
+        elif pattern[i] == '[':
+            # Like fnmatch, a ']' right after '[' or '[!' is part of the set
+            end = i + 1
+            if pattern.startswith('!', end):
+                end += 1
+            if pattern.startswith(']', end):
+                end += 1
+            end = pattern.find(']', end)
+
+            if end == -1:
+                parts.append(re.escape('['))
+                i += 1
+                continue
+
+            chars = pattern[i + 1:end].replace('\\', '\\\\')
+            if chars.startswith('!'):
+                chars = '^' + chars[1:]
+            elif chars.startswith('^'):
+                chars = '\\' + chars
+            parts.append('[' + chars + ']')
+            i = end + 1
+        else:
+            parts.append(re.escape(pattern[i]))
+            i += 1
+
+    return ''.join(parts)
+
+
+class IgnoreMatcher(object):
+    """Ignore folder patterns compiled for matching many folders.
+
+    Patterns without a '/' match a folder's name at any depth, exact names
+    with a set lookup and wildcard patterns with one combined regex.
+    Patterns with a '/' are anchored to the project root, like in
+    .gitignore: 'Renders/tmp' only matches that folder, and '**' matches
+    any number of folders.
+
+    :Args:
+    patterns (List)
+    """
+
+    def __init__(self, patterns=()):
+        self.patterns = list(patterns)
+        self.names = set()
+        name_patterns = []
+        path_patterns = []
+
+        for pattern in self.patterns:
+            pattern = os.path.normcase(pattern).replace(os.sep, '/')
+            pattern = pattern.rstrip('/')  # Only folders are matched anyway
+            if not pattern:
+                continue
+
+            if '/' in pattern:
+                path_patterns.append(translate_path(pattern.lstrip('/')))
+            elif WILDCARDS.search(pattern):
+                name_patterns.append(fnmatch.translate(pattern))
+            else:
+                self.names.add(pattern)
+
+        self.name_regex = self.combine(name_patterns)
+        self.path_regex = self.combine(
+            ['(?s:{})\\Z'.format(p) for p in path_patterns])
+
+    @staticmethod
+    def combine(regexes):
+        if not regexes:
+            return None
+        return re.compile('|'.join('(?:{})'.format(r) for r in regexes))
+
+    def match(self, path):
+        """True if the folder at path, relative to the project root, is
+        ignored by its name or path.
+        """
+        path = os.path.normcase(path)
+        name = os.path.basename(path)
+        if name in self.names:
+            return True
+
+        if self.name_regex is not None and self.name_regex.match(name):
+            return True
+
+        return self.path_regex is not None and \
+            self.path_regex.match(path.replace(os.sep, '/')) is not None
+
+    def match_any(self, path):
+        """True if the folder at path or a folder above it is ignored."""
+        parent = ''
+        for part in path.split(os.sep):
+            if part:
+                parent = os.path.join(parent, part)
+                if self.match(parent):
+                    return True
+
+        return False
+
+
+class IgnoreRules(object):
+    """Active ignore folders from the DB, compiled once.
+
+    refresh() checks a summary of the IgnoreFolder table and only reloads
+    and compiles the patterns when it changed.
+
+    :Args:
+    model (IgnoreFolder)
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.version = None
+        self.matcher = IgnoreMatcher()
+
+    def refresh(self):
+        """Return the IgnoreMatcher of the current ignore folders."""
+        version = self.model.select(
+            fn.COUNT(self.model.id), fn.MAX(self.model.id),
+            fn.SUM(self.model.removed)).tuples().get()
+
+        if version != self.version:
+            self.matcher = IgnoreMatcher(
+                folder.name for folder in self.model.select(
+                    self.model.name).where(self.model.removed == False))
+            self.version = version
+
+        return self.matcher
@@ -1,3 +1,5 @@
+import hashlib
+import hmac
 import os
 import config
 import frameioclient
@@ -5,12 +7,19 @@ from flask import Flask, jsonify, request, Response
 from flask_cors import CORS, cross_origin
 import requests
 import requests.auth
+import auth
 import sync
+from auth import TOKEN_URL, authenticated_client, client_lock, save_tokens
 from db_models import init_sync_models, init_log_model
-from db_handler import WriteQueueConsumer, db_queue
+from db_handler import WriteQueueConsumer, db_queue, queue_stats
+from events import remote_events, sync_wakeup
 from peewee import SqliteDatabase
 from time import time
 from logger import logger, handle_exception, PurgeOldLogMessages
+from hash_cache import hash_cache
+from project_cache import project_cache
+from frameioclient.client import (upload_limiter, download_limiter,
+                                  rate_limiter)
 import sys
 import threading
 import logging
@@ -24,12 +33,14 @@ cli.show_server_banner = lambda *x: None
 CORS(app, resources={r'/*': {'origins': '*'}})
 
 AUTHORIZE_URL = "https://applications.frame.io/oauth2/auth"
-TOKEN_URL = "https://applications.frame.io/oauth2/token"
+
+WEBHOOK_EVENTS = {'asset.created', 'asset.ready', 'asset.deleted'}
 
 sync_db = SqliteDatabase(os.path.join(config.DB_FOLDER, 'sync.db'),
                          pragmas={'journal_mode': 'wal'})
 Login, Project, Asset, IgnoreFolder = init_sync_models(sync_db)
 sync_db.close()
+auth.init(Login)
 
 log_db = SqliteDatabase(os.path.join(config.DB_FOLDER, 'log.db'),
                         pragmas={'journal_mode': 'wal'})
@@ -64,83 +75,6 @@ def setup_thread_excepthook():
     threading.Thread.__init__ = init
 
 
-def authenticated_client():
-    """Return authenticated frame.io client either from cache or refresh"""
-    if config.client_expires == 'NEVER':
-        return config.authenticated_client
-    if config.client_expires > time():
-        return config.authenticated_client
-
-    login = Login.select().limit(1).get()
-    if login.token == '':  # Not logged in
-        logger.info('Not logged in')
-        sync_db.close()
-        return False
-
-    if login.type == 'DEVTOKEN':
-        logger.info('Dev token login found')
-        config.authenticated_client = frameioclient.FrameioClient(login.token)
-        config.client_expires = 'NEVER'
-
-        sync_db.close()
-        return config.authenticated_client
-
-    logger.info('Refreshing OAuth token')
-    tokens = refresh_token(login.refresh_token)
-    if tokens:
-        tokens['type'] = 'OAUTH'
-        save_tokens(tokens)
-        token = tokens['access_token']
-        config.authenticated_client = frameioclient.FrameioClient(token)
-        config.client_expires = time() + 3300  # 5min padding for safety
-
-    else:
-        # Token might be too old, delete it to force use to re-auth
-        logger.info("Couldn't refresh token, signing out")
-
-        login = Login.select().limit(1).get()
-        login.token = ''
-        db_queue.put([login, 'save'])
-        
-        return False
-
-    if not sync_db.is_closed():
-        sync_db.close()
-
-    return config.authenticated_client
-
-
-def save_tokens(tokens):
-    """Save tokens to DB."""
-    login = Login.select().limit(1).get()
-
-    login.token = tokens['access_token']
-    login.refresh_token = tokens['refresh_token']
-    login.type = tokens['type']
-    if tokens['type'] == 'DEVTOKEN':
-        login.token_expires = 'NEVER'
-    else:
-        login.token_expires = time() + 3300  # 5min padding for safety
-
-    db_queue.put([login, 'save'])
-    sync_db.close()
-
-
-def refresh_token(token):
-    """Refreshes token and returns new token/refresh pair."""
-    post_data = {
-        "grant_type": "refresh_token",
-        "scope": config.SCOPES,
-        "refresh_token": token,
-        "client_id": config.CLIENT_ID
-    }
-
-    response = requests.post(TOKEN_URL, data=post_data)
-    if response.status_code == 200:
-        return response.json()
-    return False
-
-
 @app.route('/api/loginstatus', methods=['GET'])
 def login_status():
     """Check Frame.io login status and return it."""
@@ -166,10 +100,13 @@ def devtoken_login():
               'refresh_token': 'None',
               'type': 'DEVTOKEN'}
 
-    save_tokens(tokens)
-    config.authenticated_client = frameioclient.FrameioClient(
-        tokens['access_token'])
-    config.client_expires = 'NEVER'
+    with client_lock:
+        save_tokens(tokens)
+        config.authenticated_client = frameioclient.FrameioClient(
+            tokens['access_token'])
+        config.client_expires = 'NEVER'
+    project_cache.invalidate()
+    sync_wakeup.set()
 
     logger.info('Logged in with dev token')
     return Response(status=200)
@@ -195,10 +132,13 @@ def token_exchange():
     response = requests.post(TOKEN_URL, data=post_data)
     tokens = response.json()
     tokens['type'] = 'OAUTH'
-    save_tokens(tokens)
-    config.authenticated_client = frameioclient.FrameioClient(
-        tokens['access_token'])
-    config.client_expires = time() + 3300  # 5min padding for safety
+    with client_lock:
+        save_tokens(tokens)
+        config.authenticated_client = frameioclient.FrameioClient(
+            tokens['access_token'])
+        config.client_expires = time() + 3300  # 5min padding for safety
+    project_cache.invalidate()
+    sync_wakeup.set()
 
     logger.info('Logged in with OAuth')
     return Response(status=200)
@@ -207,8 +147,10 @@ def token_exchange():
 @app.route('/api/logout', methods=['POST'])
 def logout():
     """Logout of Frame.io and clear database."""
-    config.authenticated_client = None
-    config.client_expires = 0
+    with client_lock:
+        config.authenticated_client = None
+        config.client_expires = 0
+    project_cache.invalidate()
 
     login = Login.select().limit(1).get()
     db_queue.put([login, 'delete'])
@@ -226,7 +168,7 @@ def logout():
 def get_teams():
     """Get users teams from Frame.io."""
     if authenticated_client():
-        return jsonify(authenticated_client().get_all_teams())
+        return jsonify(project_cache.teams(authenticated_client()))
     return jsonify([])
 
 
@@ -247,6 +189,7 @@ def all_projects(team_id):
             'name': project.name,
             'sync': project.sync,
             'local_path': project_path,
+            'priority': project.priority,
             'deleted': project.deleted_from_frameio,
             'db_delete_requested': project.db_delete_requested})
 
@@ -264,6 +207,17 @@ def update_project(project_id):
         return Response('Bad request', status=400)
 
     req = request.get_json()
+    project_cache.invalidate()  # Pick up Frame.io changes with the new settings
+
+    if req.get('priority') is not None:
+        logger.info('Priority changed to {} for {}'.format(req['priority'],
+                                                         project.name))
+        project.priority = int(req['priority'])
+        db_queue.put([project, 'save'])
+        sync_wakeup.set('projects')
+
+        sync_db.close()
+        return Response(status=200)
 
     if req.get('sync') is not None:
         if req['sync'] is False:
@@ -275,6 +229,7 @@ def update_project(project_id):
             project.sync = True
             db_queue.put([project, 'save'])
 
+        sync_wakeup.set('projects')
         sync_db.close()
         return Response(status=200)
 
@@ -299,6 +254,7 @@ def update_project(project_id):
                 project.local_path_changed = True
 
             db_queue.put([project, 'save'])
+            sync_wakeup.set('projects')
             sync_db.close()
             return Response(status=200)
 
@@ -311,7 +267,9 @@ def remove_project(project_id):
     try:
         project = Project.get(Project.project_id == project_id)
         project.db_delete_requested = True
+        project_cache.invalidate()
         db_queue.put([project, 'save'])
+        sync_wakeup.set('projects')
 
         logger.info(
             'Project {} requested to be deleted from DB'.format(project.name))
@@ -354,6 +312,7 @@ def update_ignore_folders():
         folder = request.get_json()['folder']
         new_ignore = IgnoreFolder(name=folder, type='USER')
         db_queue.put([new_ignore, 'save'])
+        sync_wakeup.set('ignore')
 
         sync_db.close()
         return Response(status=200)
@@ -367,6 +326,7 @@ def update_ignore_folders():
 
         db_folder.removed = True
         db_queue.put([db_folder, 'save'])
+        sync_wakeup.set('ignore')
 
         sync_db.close()
         return Response(status=200)
@@ -374,6 +334,49 @@ def update_ignore_folders():
     return Response('Bad request', status=400)
 
 
+def verify_webhook(headers, body):
+    """Check the signature Frame.io sends with webhook requests."""
+    timestamp = headers.get('X-Frameio-Request-Timestamp', '')
+    signature = headers.get('X-Frameio-Signature', '')
+
+    try:
+        if abs(time() - int(timestamp)) > config.WEBHOOK_MAX_AGE:
+            return False
+    except ValueError:
+        return False
+
+    message = 'v0:{}:'.format(timestamp).encode() + body
+    expected = 'v0=' + hmac.new(config.WEBHOOK_SECRET.encode(), message,
+                                hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature)
+
+
+@app.route('/api/webhook', methods=['POST'])
+def frameio_webhook():
+    """Receive Frame.io asset events and sync their project right away."""
+    if not config.WEBHOOK_SECRET:
+        return Response('Webhooks not enabled', status=404)
+
+    if not verify_webhook(request.headers, request.get_data()):
+        return Response('Invalid signature', status=401)
+
+    event = request.get_json(silent=True) or {}
+    event_type = event.get('type')
+    project_id = (event.get('project') or {}).get('id')
+    asset_id = (event.get('resource') or {}).get('id')
+
+    if event_type in WEBHOOK_EVENTS and project_id and asset_id:
+        project = Project.get_or_none((Project.project_id == project_id) &
+                                      (Project.sync == True))
+        sync_db.close()
+
+        if project is not None:
+            remote_events.add(project_id, asset_id, event_type)
+            sync_wakeup.set('remote', project_id=project_id)
+
+    return Response(status=200)
+
+
 @app.route('/api/log', methods=['GET'])
 def latest_log_messages():
     messages = [{"text": log.text, "created_at": log.created_at} for log in
@@ -387,6 +390,31 @@ def latest_log_messages():
     return jsonify(messages)
 
 
+@app.route('/api/hashcache', methods=['DELETE'])
+def clear_hash_cache():
+    """Forget cached file hashes so files are hashed again. With a JSON
+    path, only that file's hash.
+    """
+    path = (request.get_json(silent=True) or {}).get('path')
+    if path:
+        hash_cache.invalidate(os.path.abspath(path))
+        logger.info('Hash of {} cleared'.format(path))
+        return Response(status=200)
+
+    hash_cache.clear()
+    logger.info('Hash cache cleared')
+    return Response(status=200)
+
+
+@app.route('/api/stats', methods=['GET'])
+def stats():
+    """Return internal metrics for monitoring."""
+    return jsonify(db_writer=queue_stats(),
+                   upload_parts=upload_limiter.stats(),
+                   download_parts=download_limiter.stats(),
+                   api_rate_limits=rate_limiter.stats())
+
+
 @app.route("/")
 def home():
     """Used if you want to serve both server and client from this web server.
@@ -0,0 +1,65 @@
+from threading import Lock
+from time import time
+
+import config
+
+
+class ProjectCache:
+    """Frame.io teams, projects and project account ids, kept for ttl secs.
+
+    Lists are refreshed with conditional requests, so unchanged ones only
+    cost a 304 response. Account ids don't change and are kept until
+    invalidate(), which the UI API calls when project settings or the
+    logged in user change.
+
+    :Args:
+    ttl (int): Secs before teams and projects are fetched again
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.entries = {}  # key -> (value, fetched_at)
+        self.account_ids = {}  # project_id -> account_id
+        self.lock = Lock()
+
+    def _get(self, key, fetch):
+        with self.lock:
+            cached = self.entries.get(key)
+        if cached and time() - cached[1] < self.ttl:
+            return cached[0]
+
+        value = fetch()
+        with self.lock:
+            self.entries[key] = (value, time())
+        return value
+
+    def teams(self, client):
+        return self._get('teams', lambda: list(client.get_all_teams()))
+
+    def projects(self, client):
+        """All projects of the user's teams."""
+        def fetch():
+            projects = []
+            for team in self.teams(client):
+                projects += list(client.get_projects(team['id']))
+            return projects
+
+        return self._get('projects', fetch)
+
+    def account_id(self, client, project_id):
+        with self.lock:
+            account_id = self.account_ids.get(project_id)
+        if account_id is None:
+            account_id = client.get_project(
+                project_id)['root_asset']['account_id']
+            with self.lock:
+                self.account_ids[project_id] = account_id
+        return account_id
+
+    def invalidate(self):
+        with self.lock:
+            self.entries = {}
+            self.account_ids = {}
+
+
+project_cache = ProjectCache(ttl=config.PROJECT_CACHE_TTL)
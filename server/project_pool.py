@@ -0,0 +1,162 @@
+from contextlib import contextmanager
+from threading import Condition, Thread
+from time import time
+
+import requests
+
+from logger import logger
+from scheduler import Deadline
+
+
+class ProjectSchedule:
+    def __init__(self, project_id, tasks, **intervals):
+        self.project_id = project_id
+        self.tasks = {task: Deadline(**intervals) for task in tasks}
+        self.running = False
+        self.removed = False  # Stopped syncing while running
+
+    @property
+    def next_run(self):
+        return min(deadline.next_run for deadline in self.tasks.values())
+
+
+class ProjectPool:
+    """Sync projects on a bounded pool of worker threads.
+
+    Each project has a Deadline per task, and a pass runs the tasks that
+    are due. Tasks that found work run again soon, idle ones back off, and
+    a failed pass is retried with backoff without holding up other
+    projects. A project is only synced by one worker at a time. Transfers,
+    bandwidth and API budgets stay shared by all projects.
+
+    :Args:
+    workers (int): Max projects synced at once
+    sync_project (function): Called with project_id and due tasks for a
+      pass, returns the tasks that found work
+    tasks (List): Task names
+    min_interval (int): Secs between runs of a busy task
+    max_interval (int): Max secs between runs of an idle task
+    max_backoff (int): Max secs before retrying a failed pass
+    """
+
+    def __init__(self, workers, sync_project, tasks, min_interval,
+                 max_interval, max_backoff):
+        self.sync_project = sync_project
+        self.tasks = tasks
+        self.intervals = {'min_interval': min_interval,
+                          'max_interval': max_interval,
+                          'max_backoff': max_backoff}
+        self.projects = {}  # project_id -> ProjectSchedule
+        self.paused = 0
+        self.running = 0
+        self.cond = Condition()
+
+        self.workers = [Thread(target=self.work, daemon=True,
+                               name='project-worker-{}'.format(i))
+                        for i in range(max(workers, 1))]
+
+    def start(self):
+        for worker in self.workers:
+            worker.start()
+
+    def update(self, project_ids):
+        """Set the projects to sync. New projects are synced right away."""
+        with self.cond:
+            for project_id in project_ids:
+                if project_id in self.projects:
+                    self.projects[project_id].removed = False
+                else:
+                    self.projects[project_id] = ProjectSchedule(
+                        project_id, self.tasks, **self.intervals)
+
+            for project_id in set(self.projects) - set(project_ids):
+                if self.projects[project_id].running:
+                    self.projects[project_id].removed = True
+                else:
+                    del self.projects[project_id]
+
+            self.cond.notify_all()
+
+    def wake(self, tasks=None, project_id=None):
+        """Make tasks of all projects, or just project_id, due now. All
+        tasks by default.
+        """
+        with self.cond:
+            for schedule in self.projects.values():
+                if project_id is not None and \
+                        schedule.project_id != project_id:
+                    continue
+                for task, deadline in schedule.tasks.items():
+                    if tasks is None or task in tasks:
+                        deadline.wake()
+            self.cond.notify_all()
+
+    @contextmanager
+    def pause(self):
+        """Wait for running passes to end and start no new ones meanwhile,
+        e.g. while deleting a project's assets.
+        """
+        with self.cond:
+            self.paused += 1
+            self.cond.wait_for(lambda: not self.running)
+        try:
+            yield
+        finally:
+            with self.cond:
+                self.paused -= 1
+                self.cond.notify_all()
+
+    def _next_due(self):
+        """Return (due schedule or None, secs to wait)."""
+        if self.paused:
+            return None, None
+
+        waiting = [s for s in self.projects.values()
+                   if not s.running and not s.removed]
+        if not waiting:
+            return None, None
+
+        schedule = min(waiting, key=lambda s: s.next_run)
+        delay = schedule.next_run - time()
+        if delay > 0:
+            return None, delay
+        return schedule, 0
+
+    def work(self):
+        while True:
+            with self.cond:
+                schedule, delay = self._next_due()
+                while schedule is None:
+                    self.cond.wait(delay)
+                    schedule, delay = self._next_due()
+                schedule.running = True
+                self.running += 1
+
+                now = time()
+                due = [task for task, deadline in schedule.tasks.items()
+                       if deadline.due(now)]
+                for task in due:
+                    schedule.tasks[task].start()
+
+            found = None
+            try:
+                found = self.sync_project(schedule.project_id, due)
+            except (requests.exceptions.ConnectionError,
+                    requests.exceptions.HTTPError) as e:
+                logger.info('Could not sync project {}, retrying: {}'.format(
+                    schedule.project_id, e))
+            except Exception:  # skipcq: PYL-W0703
+                logger.exception('Sync of project {} failed'.format(
+                    schedule.project_id))
+
+            with self.cond:
+                for task in due:
+                    if found is None:
+                        schedule.tasks[task].failed()
+                    else:
+                        schedule.tasks[task].done(task in found)
+                schedule.running = False
+                self.running -= 1
+                if schedule.removed:
+                    del self.projects[schedule.project_id]
+                self.cond.notify_all()
@@ -0,0 +1,195 @@
+import os
+import pickle
+
+import config
+
+SNAPSHOT_FOLDER = os.path.join(config.DB_FOLDER, 'snapshots')
+SNAPSHOT_VERSION = 1
+
+
+class ScanDiff:
+    def __init__(self):
+        self.added = []    # (path, is_dir, stat)
+        self.changed = []  # (path, is_dir, stat)
+        self.removed = []  # path
+
+
+class LocalSnapshot:
+    """Persistent index of a project's local tree, used to diff rescans.
+
+    Directories are only listed again when their mtime or inode changed.
+    Entries of unchanged directories are carried over without a stat call,
+    but child directories are still stat'ed since a directory's mtime
+    doesn't change when something deeper down does.
+
+    :Args:
+    project_id (string): Project the snapshot belongs to
+    root (path): Absolute path to the project folder
+    """
+
+    def __init__(self, project_id, root):
+        self.project_id = project_id
+        self.root = root
+        # rel path -> (mtime_ns, inode, complete, child dir names, file names)
+        self.dirs = {}
+        # rel path -> (mtime_ns, size, inode)
+        self.files = {}
+
+    @staticmethod
+    def file_path(project_id):
+        return os.path.join(SNAPSHOT_FOLDER, '{}.pickle'.format(project_id))
+
+    @classmethod
+    def load(cls, project_id, root):
+        """Load saved snapshot, or an empty one if missing or for another
+        root folder.
+        """
+        snapshot = cls(project_id, root)
+        try:
+            with open(cls.file_path(project_id), 'rb') as f:
+                data = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return snapshot
+
+        if data.get('version') == SNAPSHOT_VERSION and data['root'] == root:
+            snapshot.dirs = data['dirs']
+            snapshot.files = data['files']
+
+        return snapshot
+
+    @classmethod
+    def delete(cls, project_id):
+        try:
+            os.remove(cls.file_path(project_id))
+        except FileNotFoundError:
+            pass
+
+    def save(self):
+        os.makedirs(SNAPSHOT_FOLDER, exist_ok=True)
+        tmp_path = self.file_path(self.project_id) + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump({'version': SNAPSHOT_VERSION,
+                         'root': self.root,
+                         'dirs': self.dirs,
+                         'files': self.files}, f,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+
+        os.replace(tmp_path, self.file_path(self.project_id))
+
+    def is_empty(self):
+        return not self.dirs
+
+    def clear(self):
+        self.dirs = {}
+        self.files = {}
+
+    def scan(self, skip_dir):
+        """Walk the tree and replace the snapshot with its current state.
+
+        Hidden files and folders are skipped, like folders where
+        skip_dir(path) is True.
+
+        :Args:
+        skip_dir (function): Called with folder path relative to root
+        :Returns:
+        ScanDiff
+        """
+        diff = ScanDiff()
+        old_dirs, old_files = self.dirs, self.files
+        self.dirs, self.files = {}, {}
+
+        try:
+            stack = [('', os.stat(self.root))]
+        except FileNotFoundError:
+            stack = []
+
+        while stack:
+            rel_dir, dir_stat = stack.pop()
+            abs_dir = os.path.join(self.root, rel_dir)
+            old = old_dirs.get(rel_dir)
+
+            if old is not None and old[2] and old[0] == dir_stat.st_mtime_ns \
+                    and old[1] == dir_stat.st_ino:
+                # Listing unchanged, reuse it
+                self.dirs[rel_dir] = old
+                for name in old[4]:
+                    path = os.path.join(rel_dir, name)
+                    if path in old_files:
+                        self.files[path] = old_files[path]
+
+                for name in old[3]:
+                    path = os.path.join(rel_dir, name)
+                    if skip_dir(path):  # Ignore list may have changed
+                        continue
+
+                    try:
+                        stack.append((path, os.stat(os.path.join(abs_dir,
+                                                                 name))))
+                    except FileNotFoundError:
+                        self.dirs[rel_dir] = old[:2] + (False,) + old[3:]
+                continue
+
+            if rel_dir and os.path.islink(abs_dir):  # Not followed, like os.walk
+                self.dirs[rel_dir] = (dir_stat.st_mtime_ns, dir_stat.st_ino,
+                                      True, (), ())
+                continue
+
+            child_dirs = []
+            file_names = []
+            complete = True
+            try:
+                entries = list(os.scandir(abs_dir))
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+
+            for entry in entries:
+                if entry.name.startswith('.'):
+                    continue
+
+                path = os.path.join(rel_dir, entry.name)
+                try:
+                    is_dir = entry.is_dir()
+                    entry_stat = entry.stat()
+                except FileNotFoundError:
+                    complete = False
+                    continue
+
+                if is_dir:
+                    if skip_dir(path):
+                        continue
+
+                    child_dirs.append(entry.name)
+                    if path not in old_dirs:
+                        diff.added.append((path, True, entry_stat))
+                    stack.append((path, entry_stat))
+                    continue
+
+                file_names.append(entry.name)
+                entry_key = (entry_stat.st_mtime_ns, entry_stat.st_size,
+                             entry_stat.st_ino)
+                self.files[path] = entry_key
+
+                old_key = old_files.get(path)
+                if old_key is None:
+                    diff.added.append((path, False, entry_stat))
+                elif old_key != entry_key:
+                    diff.changed.append((path, False, entry_stat))
+
+            self.dirs[rel_dir] = (dir_stat.st_mtime_ns, dir_stat.st_ino,
+                                  complete, tuple(child_dirs),
+                                  tuple(file_names))
+
+        diff.removed = [p for p in old_files if p not in self.files]
+        diff.removed += [p for p in old_dirs if p not in self.dirs]
+        return diff
+
+    def forget(self, paths):
+        """Drop entries so they are reported again by the next scan."""
+        for path in paths:
+            self.files.pop(path, None)
+            self.dirs.pop(path, None)
+
+            parent = os.path.dirname(path)
+            if parent in self.dirs:  # Make next scan list parent again
+                self.dirs[parent] = self.dirs[parent][:2] + (False,) + \
+                                    self.dirs[parent][3:]
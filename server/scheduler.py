@@ -0,0 +1,50 @@
+from time import time
+
+
+class Deadline:
+    """When a sync task runs next, based on what its previous runs found.
+
+    A run that found work is followed by another after min_interval secs.
+    Idle runs double the interval up to max_interval, and failed runs are
+    retried with backoff up to max_backoff secs.
+
+    :Args:
+    min_interval (int): Secs between runs while busy
+    max_interval (int): Max secs between runs while idle
+    max_backoff (int): Max secs before retrying a failed run
+    """
+
+    def __init__(self, min_interval, max_interval, max_backoff):
+        self.min_interval = min_interval
+        self.max_interval = max(max_interval, min_interval)
+        self.max_backoff = max(max_backoff, min_interval)
+        self.interval = min_interval
+        self.next_run = 0
+        self.failures = 0
+        self.woken = False  # Woken while running, run again right after
+
+    def due(self, now):
+        return self.next_run <= now
+
+    def start(self):
+        self.woken = False
+
+    def wake(self):
+        """Make the task due now, and busy again."""
+        self.next_run = 0
+        self.interval = self.min_interval
+        self.woken = True
+
+    def done(self, found_work):
+        self.failures = 0
+        if found_work:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.interval * 2, self.max_interval)
+
+        self.next_run = 0 if self.woken else time() + self.interval
+
+    def failed(self):
+        self.failures += 1
+        self.next_run = time() + min(self.min_interval * 2 ** self.failures,
+                                     self.max_backoff)
@@ -1,19 +1,37 @@
-import fnmatch
+import json
 import mimetypes
 import os
+import stat
+from collections import deque
 from datetime import datetime, timedelta, timezone
 from threading import Thread
-from time import sleep, time
+from time import time
 
 import requests
 from dateutil import parser
+from dateutil.parser import isoparse
+from peewee import chunked
 from requests import auth
 
 import config
-from db_handler import db_queue
-from frameioclient.utils import calculate_hash
+from asset_metadata import asset_metadata
+from auth import authenticated_client
+from db_handler import SQLITE_MAX_VARIABLES, db_queue
+from events import PROJECT_TASKS, remote_events, sync_wakeup
+from frameioclient.next_uploader import UploadState
+from hash_cache import hash_cache
+from ignore import IgnoreMatcher, IgnoreRules
 from logger import logger
-from main import authenticated_client
+from project_cache import project_cache
+from project_pool import ProjectPool
+from scanner import LocalSnapshot
+from scheduler import Deadline
+from transfers import TransferScheduler
+from watcher import Inotify, LocalWatcher
+
+# Tasks run by SyncLoop.run in this order, as project passes use the
+# ignore folders
+LOOP_TASKS = ('ignore', 'projects', 'verify')
 
 
 class SyncLoop(Thread):
@@ -24,22 +42,43 @@ class SyncLoop(Thread):
         self.Project = project
         self.Asset = asset
         self.IgnoreFolder = ignore_folder
+        self.transfers = TransferScheduler(
+            upload_workers=config.UPLOAD_WORKERS,
+            download_workers=config.DOWNLOAD_WORKERS)
+        self.projects = ProjectPool(workers=config.PROJECT_WORKERS,
+                                    sync_project=self.sync_project,
+                                    tasks=PROJECT_TASKS,
+                                    min_interval=config.BUSY_INTERVAL,
+                                    max_interval=config.SCAN_INTERVAL,
+                                    max_backoff=config.TASK_RETRY_MAX)
+        self.tasks = {task: Deadline(min_interval=config.BUSY_INTERVAL,
+                                     max_interval=config.SCAN_INTERVAL,
+                                     max_backoff=config.TASK_RETRY_MAX)
+                      for task in LOOP_TASKS}
+
+        self.ignore_rules = IgnoreRules(ignore_folder)
+        self.ignore_folders = IgnoreMatcher()
+        self.last_full_scan = {}  # project_id -> time of last full local scan
+        self.last_frameio_search = {}  # project_id -> time of last search
+        self.watcher = None
+        if config.LOCAL_WATCH:
+            if Inotify.available():
+                self.watcher = LocalWatcher(
+                    settle_time=config.WATCH_SETTLE_TIME,
+                    skip_dir=self.skip_local_folder)
+            else:
+                logger.info('Watch mode needs Linux inotify, polling instead')
 
-    @staticmethod
-    def wildcard_match(name, ignore_list):
-        for ignore in ignore_list:
-            if fnmatch.fnmatch(name, ignore):
-                return True
-
-        return False
+    def skip_local_folder(self, path):
+        return os.path.basename(path).startswith('.') or \
+               self.ignore_folders.match(path)
 
     def update_projects(self):
-        """Get all projects from Frame.io and add new to DB."""
-        projects = []
+        """Get all projects from Frame.io and add new to DB. Return True if
+        projects were added, renamed or deleted.
+        """
         try:
-            for team in authenticated_client().get_all_teams():
-                # print(f"{team['name']}: {team['id']}")
-                projects += authenticated_client().get_projects(team['id'])
+            projects = project_cache.projects(authenticated_client())
         except (requests.exceptions.ConnectionError,
                 requests.exceptions.HTTPError):
             raise
@@ -50,21 +89,13 @@ class SyncLoop(Thread):
         #         requests.exceptions.HTTPError):
         #     raise
 
-        for project in projects:
-            try:
-                db_project = self.Project.get(
-                    self.Project.project_id == project['id'])
-
-                # Check if project has been renamed
-                if db_project.name != project['name']:
-                    db_project.name = project['name']
-                    db_queue.put([db_project, 'save'])
+        db_projects = {db_project.project_id: db_project
+                       for db_project in self.Project.select()}
+        changed = False
 
-                    logger.info(
-                        'Renamed project {} to {}'.format(db_project.name,
-                                                          project['name']))
-
-            except self.Project.DoesNotExist:
+        for project in projects:
+            db_project = db_projects.get(project['id'])
+            if db_project is None:
                 logger.info('New project found: {}'.format(project['name']))
 
                 new_project = self.Project(name=project['name'],
@@ -73,73 +104,215 @@ class SyncLoop(Thread):
                                            team_id=project['team_id'],
                                            on_frameio=True)
                 db_queue.put([new_project, 'save'])
+                db_projects[project['id']] = new_project
+                changed = True
+
+            # Check if project has been renamed
+            elif db_project.name != project['name']:
+                logger.info(
+                    'Renamed project {} to {}'.format(db_project.name,
+                                                      project['name']))
+
+                db_project.name = project['name']
+                db_queue.put([db_project, 'save'])
+                changed = True
 
         # Check if any projects have been deleted
-        active_projects = [project['id'] for project in projects]
+        active_projects = {project['id'] for project in projects}
 
-        for db_project in self.Project.select().where(
-                self.Project.deleted_from_frameio == False):
-            if db_project.project_id not in active_projects:
+        for db_project in db_projects.values():
+            if db_project.project_id not in active_projects and \
+                    db_project.id is not None and \
+                    not db_project.deleted_from_frameio:
                 db_project.deleted_from_frameio = True
                 db_project.sync = False
                 db_queue.put([db_project, 'save'])
+                changed = True
 
                 logger.info(
                     "Project {} has been deleted, "
                     "turning off sync.".format(db_project.name))
 
-    def calculate_missing_paths(self, project, parent_id, parent_path,
-                                ignore_folders, ignore):
-        """Recurse through DB and add missing paths and if folder should be
-        ignored.
+        return changed
+
+    def calculate_missing_paths(self, project, ignore_folders):
+        """Add missing paths to folders that were added before their parent,
+        and if they should be ignored.
+
+        The project's folder tree is loaded at once and walked breadth
+        first from the root.
         """
-        children = self.Asset.select().where(
-            (self.Asset.project_id == project.project_id) &
-            (self.Asset.is_file == False) &
-            (self.Asset.parent_id == parent_id))
+        children = {}
+        for folder in self.Asset.select().where(
+                (self.Asset.project_id == project.project_id) &
+                (self.Asset.is_file == False) &
+                (self.Asset.asset_id != '')):
+            children.setdefault(folder.parent_id, []).append(folder)
+
+        added = 0
+        parents = deque([(project.root_asset_id, '', False)])
+        while parents:
+            parent_id, parent_path, parent_ignore = parents.popleft()
+
+            # Popped so each folder is only visited once
+            for child in children.pop(parent_id, []):
+                if child.path == '':
+                    child.path = os.path.join(parent_path, child.name)
+                    ignore = parent_ignore or ignore_folders.match(child.path)
+                    child.ignore = ignore
+                    db_queue.put([child, 'save'])
+                    added += 1
+                else:
+                    ignore = parent_ignore or child.ignore or \
+                             ignore_folders.match(child.path)
 
-        for child in children:
-            if child.name in ignore_folders or ignore or self.wildcard_match(
-                    child.name, ignore_folders):
-                ignore = True
+                parents.append((child.asset_id, child.path, ignore))
+
+        if added:
+            logger.info('Added paths to {} folders in {}'.format(
+                added, project.name))
+
+    def project_asset_index(self, project):
+        """Load the project's assets for lookups in memory.
+
+        :Returns:
+        ({asset_id: (path, ignore)}, set of paths)
+        """
+        known = {}
+        paths = set()
+        for asset_id, path, ignore in self.Asset.select(
+                self.Asset.asset_id, self.Asset.path, self.Asset.ignore).where(
+                self.Asset.project_id == project.project_id).tuples():
+            if asset_id != '':
+                known[asset_id] = (path, ignore)
+            paths.add(path)
+
+        return known, paths
+
+    @staticmethod
+    def parents_first(folders):
+        """Order new folders so each comes after its parent, where the
+        parent is among them. Folders keep their order otherwise.
+        """
+        ids = {f['id'] for f in folders}
+        children = {}
+        ordered = []
+        for folder in folders:
+            if folder['parent_id'] in ids:
+                children.setdefault(folder['parent_id'], []).append(folder)
+            else:
+                ordered.append(folder)
 
-            if child.path == '':
-                child.path = os.path.join(parent_path, child.name)
-                child.ignore = ignore
-                db_queue.put([child, 'save'])
-                logger.info('Added path to folder {}'.format(child.path))
+        # Appending while iterating visits the children of added folders too
+        for folder in ordered:
+            ordered.extend(children.pop(folder['id'], []))
 
-            self.calculate_missing_paths(project, child.asset_id, child.path,
-                                         ignore_folders, ignore)
+        # Parent cycles, not expected from Frame.io
+        for waiting in children.values():
+            ordered.extend(waiting)
 
-    def update_frameio_assets(self, project, ignore_folders):
-        """Fetch assets that've been added since last scan and add them to DB.
+        return ordered
+
+    @staticmethod
+    def change_key(asset):
+        """Order of Frame.io changes, for the project's change cursor."""
+        return isoparse(asset['updated_at']), asset['id']
+
+    def fetch_frameio_changes(self, project, search, asset_ids):
+        """Fetch assets changed after the project's cursor, and the ones
+        that are up for retry.
 
         :Args:
         project (DB Project)
-        ignore_folders (List)
+        search (bool): False to only fetch asset_ids and retries
+        asset_ids (List): Other assets to fetch, e.g. from webhooks
+        :Returns:
+        (List of assets, retry {asset_id: first seen} without assets
+        removed from Frame.io and with asset_ids that failed to fetch,
+        new cursor or None)
         """
-        # Always overscan by 10 minutes to help avoid missing assets.
-        new_scan_timestamp = (
-                datetime.now(timezone.utc) - timedelta(minutes=10)).isoformat()
-
-        try:
-            account_id = authenticated_client().get_project(project.project_id)['root_asset']['account_id']
-            updated_assets = authenticated_client().get_updated_assets(
+        client = authenticated_client()
+        updated_assets = []
+        if search:
+            account_id = project_cache.account_id(client, project.project_id)
+            updated_assets = client.get_updated_assets(
                 account_id, project.project_id, project.last_frameio_scan)
 
-        except (requests.exceptions.ConnectionError,
-                requests.exceptions.HTTPError):
-            raise
+        cursor = (isoparse(project.last_frameio_scan), project.last_frameio_id)
+        changes = [(self.change_key(a), a) for a in updated_assets]
+        changes = {a['id']: (key, a) for key, a in changes if key > cursor}
+
+        # Recent changes are seen again next scan, the index may lag
+        settled = datetime.now(timezone.utc) - timedelta(
+            seconds=config.FRAMEIO_INDEX_LAG)
+        done = [(key, a['updated_at']) for key, a in changes.values()
+                if key[0] <= settled]
+        new_cursor = None
+        if done:
+            (_, asset_id), updated_at = max(done)
+            new_cursor = (updated_at, asset_id)
+
+        retry = json.loads(project.frameio_retry or '{}')
+        retry_ids = [i for i in set(retry) | set(asset_ids)
+                     if i not in changes]
+        if retry_ids:
+            fetched = asset_metadata.fetch(client, retry_ids)
+            for asset_id, asset in fetched.items():
+                if asset is None:
+                    retry.pop(asset_id, None)  # Removed from Frame.io
+                else:
+                    changes[asset_id] = (None, asset)
 
-        # Find assets not already in DB.
-        new_assets = []
-        for asset in updated_assets:
-            try:
-                self.Asset.get(self.Asset.asset_id == asset['id'])
+            # Events whose asset couldn't be fetched are retried later
+            for asset_id in asset_ids:
+                if asset_id not in fetched and asset_id not in changes:
+                    retry.setdefault(asset_id, int(time()))
 
-            except self.Asset.DoesNotExist:
-                new_assets.append(asset)
+        return [a for key, a in changes.values()], retry, new_cursor
+
+    def update_frameio_assets(self, project, ignore_folders, events=None,
+                              search=True):
+        """Fetch assets that've changed since last scan and add them to DB.
+
+        Changes are fetched after the project's cursor, which moves up to
+        the last change that's older than FRAMEIO_INDEX_LAG. Files that
+        can't be added yet, as their parent or upload is missing, are
+        retried for FRAMEIO_RETRY_TIME without holding the cursor back.
+
+        :Args:
+        project (DB Project)
+        ignore_folders (IgnoreMatcher)
+        events (dict): Webhook events {asset_id: type} to handle
+        search (bool): False to skip searching for changes, and only handle
+          events and retries
+
+        Return True if assets from Frame.io were added to or removed from
+        DB.
+        """
+        events = events or {}
+        deleted = [i for i, e in events.items() if e == 'asset.deleted']
+        removed = False
+        if deleted:
+            removed = self.remove_deleted_assets(project, deleted)
+
+        updated_assets, retry, cursor = self.fetch_frameio_changes(
+            project, search,
+            [i for i, e in events.items() if e != 'asset.deleted'])
+        for asset_id in deleted:
+            retry.pop(asset_id, None)
+
+        if not updated_assets and cursor is None and \
+                json.dumps(retry) == project.frameio_retry:
+            return removed  # Nothing changed
+
+        known, paths = self.project_asset_index(project)
+
+        # Retries that couldn't be fetched are kept
+        updated_ids = {a['id'] for a in updated_assets}
+        unresolved = [i for i in retry if i not in updated_ids]
+
+        # Find assets not already in DB.
+        new_assets = [a for a in updated_assets if a['id'] not in known]
 
         new_folders = [a for a in new_assets if a['type'] == 'folder']
         new_folders.sort(key=lambda a: a['inserted_at'])  # Oldest first
@@ -152,46 +325,37 @@ class SyncLoop(Thread):
 
         # Filter out duplicate folders with same name/path
         new_folders_filtered = []
+        seen_folders = set()
         for folder in new_folders:
-            if (folder['name'] + folder['parent_id']) not in [
-                f['name'] + f['parent_id'] for f in new_folders_filtered]:
+            key = (folder['name'], folder['parent_id'])
+            if key not in seen_folders:
+                seen_folders.add(key)
                 new_folders_filtered.append(folder)
 
-        for folder in new_folders_filtered:
+        for folder in self.parents_first(new_folders_filtered):
             ignore = False
             path = ''
 
-            if folder['name'] in ignore_folders or self.wildcard_match(
-                    folder['name'], ignore_folders):
-                ignore = True
-
             if folder['parent_id'] == project.root_asset_id:
                 path = folder['name']
 
-            else:
-                try:
-                    parent = self.Asset.get(
-                        self.Asset.asset_id == folder['parent_id'])
-
-                    if parent.path != '':
-                        path = os.path.join(parent.path, folder['name'])
+            elif folder['parent_id'] in known:
+                parent_path, parent_ignore = known[folder['parent_id']]
+                if parent_path != '':
+                    path = os.path.join(parent_path, folder['name'])
 
-                        if parent.ignore:
-                            ignore = True
+                    if parent_ignore:
+                        ignore = True
 
-                except self.Asset.DoesNotExist:
-                    pass
+            # Without a path yet, anchored patterns are checked once it's set
+            if ignore_folders.match(path or folder['name']):
+                ignore = True
 
             # If folder has the same path/name as an existing one, ignore it
-            try:
-                self.Asset.get(self.Asset.path == path,
-                               self.Asset.project_id == project.project_id)
+            if path in paths:
                 ignore = True
                 duplicates_folders += 1
 
-            except self.Asset.DoesNotExist:
-                pass
-
             new_asset = self.Asset(name=folder['name'],
                                    project_id=project.project_id,
                                    path=path,
@@ -200,15 +364,13 @@ class SyncLoop(Thread):
                                    ignore=ignore,
                                    on_frameio=True)
             db_queue.put([new_asset, 'save'])
+            known[folder['id']] = (path, ignore)
+            paths.add(path)
             added_folders += 1
 
         # If folders are out of order from Frame.io we need to calc paths.
-        if self.Asset.select().where(self.Asset.path == ''):
-            self.calculate_missing_paths(project=project,
-                                         parent_id=project.root_asset_id,
-                                         parent_path='',
-                                         ignore_folders=ignore_folders,
-                                         ignore=False)
+        if '' in paths:
+            self.calculate_missing_paths(project, ignore_folders)
 
         for file in new_files:
             if file['upload_completed_at'] is not None:
@@ -216,35 +378,31 @@ class SyncLoop(Thread):
                 if file['parent_id'] == project.root_asset_id:
                     parent_path = ''
 
-                else:
-                    try:
-                        parent = self.Asset.get(
-                            self.Asset.asset_id == file['parent_id'])
-
-                        if parent.path == '':
-                            logger.info(
-                                "Parent to {} path is not set, retry".format(
-                                    file['name']))
-                            continue
+                elif file['parent_id'] in known:
+                    parent_path, parent_ignore = known[file['parent_id']]
 
-                        parent_path = parent.path
+                    if parent_path == '':
+                        logger.info(
+                            "Parent to {} path is not set, retry".format(
+                                file['name']))
+                        unresolved.append(file['id'])
+                        continue
 
-                        if parent.ignore:
-                            ignore = True
+                    if parent_ignore:
+                        ignore = True
 
-                    except self.Asset.DoesNotExist:
-                        logger.info('Parent to {} not found, retry'.format(
-                            file['name']))
-                        continue
+                else:
+                    logger.info('Parent to {} not found, retry'.format(
+                        file['name']))
+                    unresolved.append(file['id'])
+                    continue
 
                 # Only add files with unique path and name.
                 asset_path = os.path.join(parent_path, file['name'])
-                try:
-                    self.Asset.get(self.Asset.path == asset_path,
-                                   self.Asset.project_id == project.project_id)
+                if asset_path in paths:
                     duplicates_files += 1
 
-                except self.Asset.DoesNotExist:
+                else:
                     new_asset = self.Asset(name=file['name'],
                                            project_id=project.project_id,
                                            path=asset_path,
@@ -255,8 +413,13 @@ class SyncLoop(Thread):
                                            ignore=ignore,
                                            on_frameio=True)
                     db_queue.put([new_asset, 'save'])
+                    known[file['id']] = (asset_path, ignore)
+                    paths.add(asset_path)
                 added_files += 1
 
+            else:
+                unresolved.append(file['id'])  # Still uploading
+
         if added_folders - duplicates_folders != 0:
             logger.info(
                 'New folders on Frame.io for project {}'.format(project.name))
@@ -264,17 +427,98 @@ class SyncLoop(Thread):
             logger.info(
                 'New files on Frame.io for project {}'.format(project.name))
 
-        if len(new_files) == added_files:  # All done. Moving up timestamp.
-            project.last_frameio_scan = new_scan_timestamp
+        # Retry files that couldn't be added, until FRAMEIO_RETRY_TIME
+        now = int(time())
+        pending = {asset_id: retry.get(asset_id, now)
+                   for asset_id in unresolved}
+        expired = [asset_id for asset_id, first_seen in pending.items()
+                   if now - first_seen > config.FRAMEIO_RETRY_TIME]
+        for asset_id in expired:
+            del pending[asset_id]
+        if expired:
+            logger.info('Gave up on {} new Frame.io files in {}'.format(
+                len(expired), project.name))
+        project.frameio_retry = json.dumps(pending)
+
+        if cursor is not None:
+            project.last_frameio_scan, project.last_frameio_id = cursor
 
         db_queue.put([project, 'save'])
 
+        # Retries still unresolved aren't work, only rows added or removed
+        return removed or added_folders > 0 or \
+            added_files - duplicates_files > 0
+
+    def remove_deleted_assets(self, project, asset_ids):
+        """Forget files deleted from Frame.io before they were downloaded.
+        Deletions of synced files aren't synced. Return True if files were
+        removed.
+        """
+        removed = False
+        for ids in chunked(asset_ids, SQLITE_MAX_VARIABLES):
+            for asset in self.Asset.select().where(
+                    (self.Asset.project_id == project.project_id) &
+                    (self.Asset.asset_id.in_(ids)) &
+                    (self.Asset.is_file == True) &
+                    (self.Asset.on_local_storage == False)):
+                logger.info('{} deleted from Frame.io'.format(asset.path))
+                db_queue.put([asset, 'delete'])
+                removed = True
+
+        return removed
+
+    def add_local_asset(self, project, abs_project_path, path, is_dir):
+        """Add local file or folder to DB if not already there.
+
+        :Returns:
+        'folder' or 'file' if added, else None
+        """
+        try:
+            db_asset = self.Asset.get(
+                self.Asset.project_id == project.project_id,
+                self.Asset.path == path)
+
+            # Already synced
+            if db_asset.on_local_storage is False:
+                db_asset.on_local_storage = True
+                db_queue.put([db_asset, 'save'])
+            return None
+
+        except self.Asset.DoesNotExist:
+            pass
+
+        if is_dir:
+            new_asset = self.Asset(name=os.path.basename(path),
+                                   project_id=project.project_id,
+                                   on_local_storage=True,
+                                   path=path)
+            db_queue.put([new_asset, 'save'])
+            return 'folder'
+
+        # Hashed while uploading unless already cached
+        file_hash = hash_cache.lookup(os.path.join(abs_project_path, path))
+        new_asset = self.Asset(name=os.path.basename(path),
+                               project_id=project.project_id,
+                               path=path,
+                               is_file=True,
+                               on_local_storage=True,
+                               local_xxhash=file_hash or '')
+        db_queue.put([new_asset, 'save'])
+        return 'file'
+
     def update_local_assets(self, project, ignore_folders):
         """Scan local storage for assets and creates new ones in DB.
 
+        Only paths added or changed since the previous scan are checked
+        against the DB, see LocalSnapshot. In watch mode, settled paths from
+        the watcher are used and full scans only run every
+        WATCH_RECONCILE_INTERVAL.
+
+        Return True if new assets were added.
+
         :Args:
         project (DB project)
-        ignore_folders (List)
+        ignore_folders (IgnoreMatcher)
         """
         abs_project_path = os.path.abspath(project.local_path)
         if not os.path.isdir(abs_project_path):
@@ -282,106 +526,118 @@ class SyncLoop(Thread):
                 'Local folder for {} not found, turning off sync'.format(
                     project.name))
             self.delete_db_project(project)
-            return
+            return False
+
+        settled = set()
+        if self.watcher and self.watcher.is_watching(project.project_id,
+                                                     abs_project_path):
+            settled, full_scan = self.watcher.settled(project.project_id)
+            reconcile_due = time() - self.last_full_scan.get(
+                project.project_id, 0) > config.WATCH_RECONCILE_INTERVAL
 
+            if not full_scan and not reconcile_due:
+                return self.add_watched_assets(project, abs_project_path,
+                                               settled, ignore_folders)
+
+        self.last_full_scan[project.project_id] = time()
         new_scan_time = int(time()) - 500  # Overscan to avoid missing assets.
-        all_assets_ready = True
-        new_folders = False
-        new_files = False
-
-        for root, dirs, files in os.walk(abs_project_path, topdown=True):
-            dirs[:] = [d for d in dirs if
-                       d not in ignore_folders and not d.startswith(
-                           ".") and not self.wildcard_match(d, ignore_folders)]
-
-            for name in files:
-                full_path = os.path.join(root, name)
-                if not name.startswith('.'):
-                    try:
-                        create_time = os.path.getctime(full_path)
-                    except FileNotFoundError:
-                        all_assets_ready = False
-                        continue
+        added = {'folder': 0, 'file': 0}
+        not_ready = []
 
-                    # Add new file criteria
-                    # - Created since last complete scan (all_assets_ready)
-                    # - Not changed in the last 60 secs
-                    # - Size not 0
-                    if create_time > project.last_local_scan:
-                        if (time() - create_time) < 60 or os.path.getsize(
-                                full_path) == 0:
-                            all_assets_ready = False
-                            continue
-
-                        path = os.path.relpath(full_path, abs_project_path)
-
-                        try:
-                            db_asset = self.Asset.get(
-                                self.Asset.project_id == project.project_id,
-                                self.Asset.path == path)
-
-                            # Already synced
-                            if db_asset.on_local_storage is False:
-                                db_asset.on_local_storage = True
-                                db_queue.put([db_asset, 'save'])
-
-                        # New file
-                        except self.Asset.DoesNotExist:
-                            try:
-                                file_hash = calculate_hash(full_path)
-                            except FileNotFoundError:
-                                all_assets_ready = False
-                                continue
-
-                            new_files = True
-                            new_asset = self.Asset(name=name,
-                                                   project_id=project.project_id,
-                                                   path=path,
-                                                   is_file=True,
-                                                   on_local_storage=True,
-                                                   local_xxhash=file_hash)
-                            db_queue.put([new_asset, 'save'])
-
-            for name in dirs:
-                full_path = os.path.join(root, name)
-                try:
-                    create_time = os.path.getctime(full_path)
-                except FileNotFoundError:
-                    all_assets_ready = False
-                    continue
+        snapshot = LocalSnapshot.load(project.project_id, abs_project_path)
+        if project.last_local_scan == 0:
+            snapshot.clear()  # Full re-scan requested
+        initial_scan = snapshot.is_empty()
+
+        diff = snapshot.scan(skip_dir=ignore_folders.match)
+
+        for path, is_dir, entry_stat in diff.added + diff.changed:
+            # Without a previous snapshot, skip assets handled by earlier scans
+            if initial_scan and entry_stat.st_ctime <= project.last_local_scan:
+                continue
 
-                if create_time > project.last_local_scan:
-                    path = os.path.relpath(full_path, abs_project_path)
+            if not is_dir:
+                # Add new file criteria
+                # - Not changed in the last 60 secs, unless the watcher
+                #   has seen it settle
+                # - Size not 0
+                if entry_stat.st_size == 0 or (
+                        path not in settled and
+                        (time() - entry_stat.st_ctime) < 60):
+                    not_ready.append(path)
+                    continue
 
-                    try:
-                        db_asset = self.Asset.get(
-                            self.Asset.project_id == project.project_id,
-                            self.Asset.path == path)
+            try:
+                result = self.add_local_asset(project, abs_project_path, path,
+                                              is_dir)
+            except FileNotFoundError:
+                not_ready.append(path)
+                continue
 
-                        # Already synced
-                        if db_asset.on_local_storage is False:
-                            db_asset.on_local_storage = True
-                            db_queue.put([db_asset, 'save'])
+            if result:
+                added[result] += 1
 
-                    except self.Asset.DoesNotExist:
-                        new_folders = True
-                        new_asset = self.Asset(name=name,
-                                               project_id=project.project_id,
-                                               on_local_storage=True,
-                                               path=path)
-                        db_queue.put([new_asset, 'save'])
+        # Report files that aren't ready again on next scan
+        snapshot.forget(not_ready)
+        snapshot.save()
 
-        if all_assets_ready:
+        if not not_ready:
             project.last_local_scan = new_scan_time
             db_queue.put([project, 'save'])
 
-        if new_folders:
+        return self.log_new_local_assets(project, added)
+
+    def add_watched_assets(self, project, abs_project_path, paths,
+                           ignore_folders):
+        """Add settled paths reported by the watcher."""
+        added = {'folder': 0, 'file': 0}
+
+        for path in sorted(paths):  # Parents before children
+            parent = os.path.dirname(path)
+            if any(part.startswith('.') for part in parent.split(os.sep)) or \
+                    ignore_folders.match_any(parent):
+                continue
+
+            try:
+                entry_stat = os.stat(os.path.join(abs_project_path, path))
+                is_dir = stat.S_ISDIR(entry_stat.st_mode)
+                if not is_dir and entry_stat.st_size == 0:
+                    continue  # Picked up again when written to
+
+                result = self.add_local_asset(project, abs_project_path, path,
+                                              is_dir)
+            except FileNotFoundError:
+                continue
+
+            if result:
+                added[result] += 1
+
+        return self.log_new_local_assets(project, added)
+
+    @staticmethod
+    def log_new_local_assets(project, added):
+        if added['folder']:
             logger.info(
                 'New local folders for project {}'.format(project.name))
-        if new_files:
+        if added['file']:
             logger.info(
                 'New local files for project {}'.format(project.name))
 
+        return bool(added['folder'] or added['file'])
+
+    def update_watches(self, projects):
+        """Watch folders of synced projects and stop watching the rest."""
+        watched = set()
+        for project in projects:
+            if project.local_path != '':
+                if self.watcher.watch(project.project_id,
+                                      os.path.abspath(project.local_path)):
+                    watched.add(project.project_id)
+
+        for project_id in self.watcher.watched_projects():
+            if project_id not in watched:
+                self.watcher.unwatch(project_id)
+
     def download_new_assets(self, project):
         """Get new assets from DB and download them"""
         new_folders = self.Asset.select().where(
@@ -411,44 +667,69 @@ class SyncLoop(Thread):
             folder.on_local_storage = True
             db_queue.put([folder, 'save'])
 
-        for file in new_files:
-            try:
-                asset = authenticated_client().get_asset(file.asset_id)
-            except requests.exceptions.HTTPError:
-                logger.info('File removed from Frame.io')
-                db_queue.put(file, 'delete')
-                continue
+        new_files = [file for file in new_files
+                     if not self.transfers.is_queued('download', file.id)]
+
+        for batch in chunked(new_files, config.ASSET_FETCH_BATCH):
+            assets = asset_metadata.fetch(authenticated_client(),
+                                          [file.asset_id for file in batch])
 
-            if asset['checksums'] is None:
-                logger.info('No checksum for {}'.format(file.name))
+            for file in batch:
+                if file.asset_id not in assets:
+                    continue  # Couldn't fetch, retry next loop
 
-                # Allow Frame.io some time to calculate hash, retry next loop
-                asset_uploaded_epoch = parser.parse(
-                    asset['upload_completed_at']).timestamp()
-                if time() - asset_uploaded_epoch < 300:
-                    logger.info('Waiting for checksum'.format(file.name))
+                asset = assets[file.asset_id]
+                if asset is None:
+                    logger.info('File removed from Frame.io')
+                    db_queue.put([file, 'delete'])
                     continue
 
-            download_folder = os.path.join(project.local_path,
-                                           os.path.dirname(file.path))
+                if asset['checksums'] is None:
+                    logger.info('No checksum for {}'.format(file.name))
 
-            if os.path.isdir(download_folder):
-                logger.info('Downloading: {}'.format(file.path))
+                    # Allow Frame.io some time to calculate hash, retry next
+                    # loop
+                    asset_uploaded_epoch = parser.parse(
+                        asset['upload_completed_at']).timestamp()
+                    if time() - asset_uploaded_epoch < 300:
+                        logger.info('Waiting for checksum'.format(file.name))
+                        continue
 
-                try:
-                    authenticated_client().download(asset,
-                                                    download_folder=download_folder,
-                                                    replace=False)
+                self.transfers.submit('download', file.id,
+                                      asset.get('filesize') or 0,
+                                      project.priority, self.download_file,
+                                      project, file, asset)
 
-                except FileExistsError:
-                    logger.info('{} already exists.'.format(file.path))
+    def download_file(self, project, file, asset):
+        """Download single asset, run by transfer workers."""
+        file = self.Asset.get_or_none(self.Asset.id == file.id)
+        if file is None or file.on_local_storage:
+            return  # Handled while queued
 
-                # Add local props to new file
-                file.on_local_storage = True
-                db_queue.put([file, 'save'])
-            else:
-                logger.info('Download folder not found: {}'.format(file.path))
-                db_queue.put([file, 'delete'])
+        download_folder = os.path.join(project.local_path,
+                                       os.path.dirname(file.path))
+
+        if os.path.isdir(download_folder):
+            logger.info('Downloading: {}'.format(file.path))
+
+            try:
+                file_hash = authenticated_client().download(
+                    asset, download_folder=download_folder, replace=False)
+
+                if file_hash:
+                    file.local_xxhash = file_hash
+                    hash_cache.store(os.path.join(download_folder,
+                                                  asset['name']), file_hash)
+
+            except FileExistsError:
+                logger.info('{} already exists.'.format(file.path))
+
+            # Add local props to new file
+            file.on_local_storage = True
+            db_queue.put([file, 'save'])
+        else:
+            logger.info('Download folder not found: {}'.format(file.path))
+            db_queue.put([file, 'delete'])
 
     @staticmethod
     def new_frameio_folder(name, parent_asset_id):
@@ -509,21 +790,95 @@ class SyncLoop(Thread):
             parent_path = path
 
     @staticmethod
-    def upload_asset(abs_path, parent_asset_id):
-        """Upload single asset to Frame.io."""
+    def upload_state_path(asset_id):
+        return os.path.join(config.UPLOAD_STATE_FOLDER,
+                            '{}.state'.format(asset_id))
+
+    @staticmethod
+    def send_file(abs_path, frameio_asset, state):
+        """Upload file content and cache its hash.
+
+        :Returns:
+        (Frame.io asset, xxh64 calculated while uploading or None)
+        """
+        file_stat = os.stat(abs_path)
+        with open(abs_path, "rb") as ul_file:
+            file_hash = authenticated_client().upload(frameio_asset, ul_file,
+                                                      state=state)
+
+        if file_hash:
+            hash_cache.store(abs_path, file_hash, file_stat)
+
+        return frameio_asset, file_hash
+
+    def resume_upload(self, abs_path, asset):
+        """Continue interrupted upload of DB asset, if its sent chunks
+        were recorded and neither the file nor Frame.io asset changed.
+
+        :Returns:
+        Same as send_file(), or None if it can't be resumed
+        """
+        state_path = self.upload_state_path(asset.asset_id)
+        state = UploadState.load(state_path, asset.asset_id,
+                                 os.stat(abs_path))
+        if state is None:
+            return None
+
+        try:
+            frameio_asset = authenticated_client().get_asset(asset.asset_id)
+        except requests.exceptions.HTTPError:
+            state.delete()
+            return None
+
+        logger.info('Resuming upload of {}, {} of {} chunks sent'.format(
+            asset.name, len(state.done), len(state.header['upload_urls'])))
+
+        frameio_asset.update(state.asset)
+        try:
+            return self.send_file(abs_path, frameio_asset, state)
+        except requests.exceptions.HTTPError as e:
+            if e.response is not None and e.response.status_code < 500:
+                state.delete()  # Upload urls expired, start over next time
+            raise
+
+    def upload_asset(self, abs_path, parent_asset_id, asset):
+        """Upload file of DB asset to Frame.io, resuming its previous
+        upload if it was interrupted. A previous upload that can't be
+        resumed is deleted from Frame.io.
+
+        The new asset id is saved to DB before sending the file, so an
+        interrupted upload can be found again.
+
+        :Returns:
+        (new Frame.io asset, xxh64 calculated while uploading or None)
+        """
+        if asset.asset_id:
+            resumed = self.resume_upload(abs_path, asset)
+            if resumed is not None:
+                return resumed
+
+            try:
+                authenticated_client().delete_asset(asset.asset_id)
+            except requests.exceptions.HTTPError:  # Deleted by user already.
+                pass
+
+        file_stat = os.stat(abs_path)
         file_mime = mimetypes.guess_type(abs_path)[0]
         new_asset = authenticated_client().create_asset(
             parent_asset_id=parent_asset_id,
             name=os.path.basename(abs_path),
             type="file",
             filetype=file_mime,
-            filesize=os.path.getsize(abs_path)
+            filesize=file_stat.st_size
         )
 
-        with open(abs_path, "rb") as ul_file:
-            authenticated_client().upload(new_asset, ul_file)
+        asset.asset_id = new_asset['id']
+        asset.original = new_asset['original']
+        db_queue.put([asset, 'save'])
 
-        return new_asset
+        state = UploadState.create(self.upload_state_path(new_asset['id']),
+                                   new_asset, file_stat)
+        return self.send_file(abs_path, new_asset, state)
 
     def upload_new_assets(self, project):
         """Upload new local assets to Frame.io and save new asset ids to DB."""
@@ -551,35 +906,70 @@ class SyncLoop(Thread):
                                             new_folder_path=folder.path)
 
         for file in new_files:
-            if not os.path.isfile(os.path.join(project.local_path, file.path)):
-                logger.info("Can't find {}".format(file.name))
-                db_queue.put([file, 'delete'])
-                continue
+            try:
+                size = os.path.getsize(
+                    os.path.join(project.local_path, file.path))
+            except OSError:
+                size = 0
+
+            self.transfers.submit('upload', file.id, size, project.priority,
+                                  self.upload_file, project, file)
+
+    def upload_file(self, project, file):
+        """Upload single asset, run by transfer workers."""
+        file = self.Asset.get_or_none(self.Asset.id == file.id)
+        if file is None or file.on_frameio:
+            return  # Handled while queued
+
+        if not os.path.isfile(os.path.join(project.local_path, file.path)):
+            logger.info("Can't find {}".format(file.name))
+            db_queue.put([file, 'delete'])
+            return
 
-            logger.info('Uploading asset: {}'.format(file.path))
-            abs_path = os.path.abspath(
-                os.path.join(project.local_path, file.path))
+        logger.info('Uploading asset: {}'.format(file.path))
+        abs_path = os.path.abspath(
+            os.path.join(project.local_path, file.path))
 
-            if os.path.dirname(file.path) == '':
-                parent_asset_id = project.root_asset_id
-            else:
-                parent_asset_id = self.Asset.get(
-                    self.Asset.project_id == project.project_id,
-                    self.Asset.path == os.path.dirname(
-                        file.path)).asset_id
+        if os.path.dirname(file.path) == '':
+            parent_asset_id = project.root_asset_id
+        else:
+            parent_asset_id = self.Asset.get(
+                self.Asset.project_id == project.project_id,
+                self.Asset.path == os.path.dirname(
+                    file.path)).asset_id
 
-            new_asset = self.upload_asset(abs_path, parent_asset_id)
-            logger.info('Upload done')
+        new_asset, file_hash = self.upload_asset(abs_path, parent_asset_id,
+                                                 file)
+        logger.info('Upload done: {}'.format(file.path))
 
-            file.asset_id = new_asset['id']
-            file.original = new_asset['original']
-            file.uploaded_at = int(time())
-            file.on_frameio = True
-            file.upload_verified = False
-            db_queue.put([file, 'save'])
+        if file_hash:
+            file.local_xxhash = file_hash
+
+        file.uploaded_at = int(time())
+        file.on_frameio = True
+        file.upload_verified = False
+        db_queue.put([file, 'save'])
+
+    def queue_reupload(self, project, asset):
+        """Queue delete_and_reupload on the upload workers."""
+        try:
+            size = os.path.getsize(
+                os.path.join(project.local_path, asset.path))
+        except OSError:
+            size = 0
+
+        self.transfers.submit('upload', asset.id, size, project.priority,
+                              self.delete_and_reupload, project, asset)
 
     def delete_and_reupload(self, project, asset):
-        """Delete and re-upload asset to Frame.io. Max attempts: 3."""
+        """Delete and re-upload asset to Frame.io. Max attempts: 3.
+
+        Run by transfer workers, see queue_reupload.
+        """
+        asset = self.Asset.get_or_none(self.Asset.id == asset.id)
+        if asset is None or asset.upload_verified:
+            return
+
         logger.info('Deleting and re-uploading: {}'.format(asset.name))
 
         if asset.upload_retries == 2:
@@ -589,15 +979,15 @@ class SyncLoop(Thread):
             db_queue.put([asset, 'save'])
             return
 
-        try:
-            authenticated_client().delete_asset(asset.asset_id)
-        except requests.exceptions.HTTPError:  # Deleted by user already.
-            pass
-
         abs_path = os.path.abspath(
             os.path.join(project.local_path, asset.path))
 
         if not os.path.isfile(abs_path):
+            try:
+                authenticated_client().delete_asset(asset.asset_id)
+            except requests.exceptions.HTTPError:  # Deleted by user already.
+                pass
+
             logger.info('{} not found'.format(asset.name))
             db_queue.put([asset, 'delete'])
             return
@@ -610,9 +1000,16 @@ class SyncLoop(Thread):
                 self.Asset.path == os.path.dirname(
                     asset.path)).asset_id
 
-        new_asset = self.upload_asset(abs_path, parent_asset_id)
-        asset.asset_id = new_asset['id']
-        asset.original = new_asset['original']
+        # The cached local hash didn't match, hash the file again
+        hash_cache.invalidate(abs_path)
+
+        # Resumes the upload if it was interrupted, else deletes and
+        # uploads again.
+        new_asset, file_hash = self.upload_asset(abs_path, parent_asset_id,
+                                                 asset)
+        if file_hash:
+            asset.local_xxhash = file_hash
+
         asset.uploaded_at = int(time())
         asset.on_frameio = True
         asset.upload_verified = False
@@ -622,63 +1019,94 @@ class SyncLoop(Thread):
     def verify_new_uploads(self):
         """Get xxhash from Frame.io and compare it to local hash in DB.
         Call delete and re-upload if hashes don't match.
+
+        Return True if uploads were verified or re-uploaded.
         """
         new_assets = self.Asset.select().where(
             (self.Asset.upload_verified == False))
 
+        # Giving Frame.io time to calculate hash.
+        new_assets = [asset for asset in new_assets
+                      if int(time()) - asset.uploaded_at >= 100 and
+                      not self.transfers.is_queued('upload', asset.id)]
+
         if len(new_assets) == 0:
-            return
+            return False
+
+        projects = {project.project_id: project
+                    for project in self.Project.select()}
+        checked = False
+
+        for batch in chunked(new_assets, config.ASSET_FETCH_BATCH):
+            frameio_assets = asset_metadata.fetch(
+                authenticated_client(), [asset.asset_id for asset in batch])
+
+            for asset in batch:
+                if asset.asset_id in frameio_assets and \
+                        asset.project_id in projects:
+                    checked |= self.verify_upload(
+                        projects[asset.project_id], asset,
+                        frameio_assets[asset.asset_id])
+
+        return checked
 
-        for asset in new_assets:
-            if int(time()) - asset.uploaded_at < 100:
-                continue  # Giving Frame.io time to calculate hash.
+    def verify_upload(self, project, asset, frameio_asset):
+        """Compare hash of a new upload to Frame.io's, see
+        verify_new_uploads.
 
-            logger.info('New upload to verify: {}'.format(asset.path))
+        :Args:
+        project (DB Project)
+        asset (DB Asset)
+        frameio_asset (dict): None if deleted from Frame.io
+
+        Return False if still waiting for Frame.io's checksum.
+        """
+        logger.info('New upload to verify: {}'.format(asset.path))
 
-            project = self.Project.get(
-                self.Project.project_id == asset.project_id)
+        if frameio_asset is None:
+            logger.info('Asset deleted from Frame.io, skipping')
+            asset.upload_verified = True
+            db_queue.put([asset, 'save'])
+            return True
 
+        if frameio_asset.get('upload_completed_at') is None:
+            logger.info('Upload failed')
+            self.queue_reupload(project=project, asset=asset)
+
+        else:
             try:
-                frameio_asset = authenticated_client().get_asset(
-                    asset.asset_id)
-            except requests.exceptions.HTTPError:
-                logger.info('Asset deleted from Frame.io, skipping')
-                asset.upload_verified = True
-                db_queue.put([asset, 'save'])
-                continue
+                frameio_hash = frameio_asset['checksums']['xx_hash']
+                if frameio_hash != asset.local_xxhash:
+                    logger.info('Hash mismatch')
+                    self.queue_reupload(project=project, asset=asset)
 
-            if frameio_asset.get('upload_completed_at') is None:
-                logger.info('Upload failed')
-                self.delete_and_reupload(project=project, asset=asset)
+                else:
+                    logger.info('Upload succeeded')
+                    asset.frameio_xxhash = frameio_hash
+                    asset.upload_verified = True
+                    db_queue.put([asset, 'save'])
 
-            else:
-                try:
-                    frameio_hash = frameio_asset['checksums']['xx_hash']
-                    if frameio_hash != asset.local_xxhash:
-                        logger.info('Hash mismatch')
-                        self.delete_and_reupload(project=project, asset=asset)
-
-                    else:
-                        logger.info('Upload succeeded')
-                        asset.frameio_xxhash = frameio_hash
-                        asset.upload_verified = True
-                        db_queue.put([asset, 'save'])
-
-                except (KeyError, TypeError):
-                    logger.info('No calculated checksum yet')
-
-                    # Edge cases where Frame.io fails to calculate a checksum.
-                    # Mark as successful anyway.
-                    if (time() - asset.uploaded_at) > 1800:
-                        logger.info(
-                            """30 mins since upload and no checksum on 
-                            Frame.io, marking as successful anyway""")
-                        asset.upload_verified = True
-                        db_queue.put([asset, 'save'])
+            except (KeyError, TypeError):
+                logger.info('No calculated checksum yet')
+
+                # Edge cases where Frame.io fails to calculate a checksum.
+                # Mark as successful anyway.
+                if (time() - asset.uploaded_at) > 1800:
+                    logger.info(
+                        """30 mins since upload and no checksum on 
+                        Frame.io, marking as successful anyway""")
+                    asset.upload_verified = True
+                    db_queue.put([asset, 'save'])
+                    return True
+
+                return False
+
+        return True
 
     def delete_db_project(self, project):
         """Delete project and its associated assets from DB."""
         logger.info('Deleting project {} from DB.'.format(project.name))
+        LocalSnapshot.delete(project.project_id)
 
         for asset in self.Asset.select().where(
                 self.Asset.project_id == project.project_id):
@@ -699,8 +1127,7 @@ class SyncLoop(Thread):
                 db_queue.put([asset, 'save'])
 
             if not asset.is_file:
-                if asset.name not in ignore_folders and not self.wildcard_match(
-                        asset.name, ignore_folders):
+                if not ignore_folders.match(asset.path or asset.name):
                     asset.ignore = False
                     db_queue.put([asset, 'save'])
                     children = self.Asset.select().where(
@@ -719,9 +1146,7 @@ class SyncLoop(Thread):
         removed_ignore_folders = self.IgnoreFolder.select().where(
             self.IgnoreFolder.removed == True)
 
-        active_ignore_folders = [folder.name for folder in
-                                 self.IgnoreFolder.select().where(
-                                     self.IgnoreFolder.removed == False)]
+        active_ignore_folders = self.ignore_rules.refresh()
 
         all_blocked_folders = self.Asset.select().where(
             (self.Asset.ignore == True) &
@@ -730,9 +1155,9 @@ class SyncLoop(Thread):
         for ignore_folder in removed_ignore_folders:
             logger.info('Removing ignore folder {}'.format(ignore_folder.name))
 
+            removed = IgnoreMatcher([ignore_folder.name])
             blocked_folders = [f for f in all_blocked_folders if
-                               f.name == ignore_folder.name or self.wildcard_match(
-                                   f.name, [ignore_folder.name])]
+                               removed.match(f.path or f.name)]
 
             self.remove_ignore_flag(blocked_folders, active_ignore_folders)
             db_queue.put([ignore_folder, 'delete'])
@@ -741,59 +1166,169 @@ class SyncLoop(Thread):
             project.last_local_scan = 0
             db_queue.put([project, 'save'])
 
-    def run(self):
-        while True:
-            if authenticated_client():
-                try:
-                    logger.info('Checking for updates')
-                    self.update_projects()
-
-                    ignore_folders = [folder.name for folder in
-                                      self.IgnoreFolder.select().where(
-                                          self.IgnoreFolder.removed == False)]
+    def sync_project(self, project_id, tasks):
+        """Run the due tasks of a project, called by its ProjectPool worker.
+        Return the tasks that found work.
+        """
+        found = set()
+        project = self.Project.get_or_none(
+            (self.Project.project_id == project_id) &
+            (self.Project.sync == True))
+        if project is None or not authenticated_client():
+            return found
 
-                    for project in self.Project.select().where(
-                            self.Project.sync == True):
-                        self.update_frameio_assets(
-                            project=project,
-                            ignore_folders=ignore_folders)
+        try:
+            if 'remote' in tasks:
+                # With webhooks, searching for changes is only a fallback
+                search = not config.WEBHOOK_SECRET or time() - \
+                    self.last_frameio_search.get(project_id, 0) > \
+                    config.WEBHOOK_RECONCILE_INTERVAL
 
-                        self.update_local_assets(
+                events = remote_events.take(project_id)
+                try:
+                    if self.update_frameio_assets(
                             project=project,
-                            ignore_folders=ignore_folders)
+                            ignore_folders=self.ignore_folders,
+                            events=events, search=search):
+                        found.add('remote')
+                except Exception:
+                    remote_events.put_back(project_id, events)
+                    raise
+                if search:
+                    self.last_frameio_search[project_id] = time()
+
+            if 'local' in tasks:
+                if self.update_local_assets(
+                        project=project, ignore_folders=self.ignore_folders):
+                    found.add('local')
+
+            if config.SyncSetting.ASSETS_LOCAL_TO_FRAME:
+                self.upload_new_assets(project)
+            if config.SyncSetting.ASSETS_FRAMEIO_TO_LOCAL:
+                self.download_new_assets(project)
+        finally:
+            self.db.close()
+
+        return found
+
+    def sync_project_list(self):
+        """Update projects from Frame.io and the UI, and the projects
+        ProjectPool syncs. Return True if projects changed.
+        """
+        changed = self.update_projects()
 
-                        if config.SyncSetting.ASSETS_LOCAL_TO_FRAME:
-                            self.upload_new_assets(project)
-                        if config.SyncSetting.ASSETS_FRAMEIO_TO_LOCAL:
-                            self.download_new_assets(project)
+        projects = list(self.Project.select().where(
+            self.Project.sync == True))
+        if self.watcher:
+            self.update_watches(projects)
 
-                    self.verify_new_uploads()
+        self.projects.update([project.project_id for project in projects])
 
-                except (requests.exceptions.ConnectionError,
-                        requests.exceptions.HTTPError):
-                    logger.info('Could not connect, retrying in {}'.format(
-                        config.SCAN_INTERVAL))
+        # Changes below rewrite projects' assets, so they wait for running
+        # project scans.
+        deleted = self.Project.select().where(
+            self.Project.db_delete_requested == True)
+        path_changed = self.Project.select().where(
+            self.Project.local_path_changed == True)
 
+        if deleted or path_changed:
+            with self.projects.pause():
                 # Delete project from DB if requested by user.
-                for project in self.Project.select().where(
-                        self.Project.db_delete_requested == True):
+                for project in deleted:
                     self.delete_db_project(project)
 
-                # Delete assets to redo sync from scratch if path has been changed.
-                for project in self.Project.select().where(
-                        self.Project.local_path_changed == True):
+                # Delete assets to redo sync from scratch if path has been
+                # changed.
+                for project in path_changed:
                     logger.info('Path changed, deleting and recreating assets in db')
 
                     self.delete_assets_from_db(project)
                     project.local_path_changed = False
                     project.last_local_scan = 0
                     project.last_frameio_scan = '2014-02-07T00:00:01.000000+00:00'
+                    project.last_frameio_id = ''
+                    project.frameio_retry = '{}'
                     db_queue.put([project, 'save'])
 
-                # Updated ignored assets if an ignore folder has been removed.
-                if self.IgnoreFolder.select().where(
-                        self.IgnoreFolder.removed == True):
-                    self.update_ignored_assets()
+                # Let the writes land before projects scan again
+                db_queue.join()
+
+            self.projects.wake()
+            changed = True
+
+        return changed
+
+    def sync_ignore_folders(self):
+        """Recompile changed ignore folders and update assets blocked by
+        removed ones. Return True if ignore folders changed.
+        """
+        matcher = self.ignore_folders
+        self.ignore_folders = self.ignore_rules.refresh()
+        changed = self.ignore_folders is not matcher
+
+        ignore_removed = self.IgnoreFolder.select().where(
+            self.IgnoreFolder.removed == True)
+
+        if ignore_removed:
+            with self.projects.pause():
+                self.update_ignored_assets()
+                self.ignore_folders = self.ignore_rules.refresh()
+
+                # Let the writes land before projects scan again
+                db_queue.join()
+            changed = True
+
+        if changed:
+            self.projects.wake()
+
+        return changed
+
+    def run_task(self, task):
+        """Run a SyncLoop task, return True if it found work."""
+        if task == 'projects':
+            return self.sync_project_list()
+        if task == 'ignore':
+            return self.sync_ignore_folders()
+        return self.verify_new_uploads()
+
+    def run(self):
+        self.transfers.start()
+        self.projects.start()
+        if self.watcher:
+            self.watcher.start()
+
+        while True:
+            woken, woken_projects = sync_wakeup.take()
+            for task in woken:
+                if task in self.tasks:
+                    self.tasks[task].wake()
+            if woken & set(PROJECT_TASKS):
+                self.projects.wake(woken & set(PROJECT_TASKS))
+            for project_id, tasks in woken_projects.items():
+                self.projects.wake(tasks, project_id=project_id)
+
+            if woken or woken_projects:
+                db_queue.join()  # Let changes from the UI API land
+
+            if not authenticated_client():
+                sync_wakeup.wait(config.SCAN_INTERVAL)
+                continue
+
+            for task in LOOP_TASKS:
+                deadline = self.tasks[task]
+                if not deadline.due(time()):
+                    continue
+
+                deadline.start()
+                try:
+                    deadline.done(self.run_task(task))
+                except (requests.exceptions.ConnectionError,
+                        requests.exceptions.HTTPError):
+                    deadline.failed()
+                    logger.info('Could not connect, retrying {} in {}'.format(
+                        task, int(deadline.next_run - time())))
+
+            self.db.close()
 
-                self.db.close()
-            sleep(config.SCAN_INTERVAL)
+            next_run = min(d.next_run for d in self.tasks.values())
+            sync_wakeup.wait(max(next_run - time(), 0))
@@ -0,0 +1,141 @@
+from itertools import count
+from threading import Condition, Thread
+
+import requests
+
+from db_handler import db_queue
+from logger import logger
+
+
+class TransferJob:
+    def __init__(self, key, kind, size, priority, func, args):
+        self.key = key
+        self.kind = kind
+        self.size = size
+        self.priority = priority
+        self.func = func
+        self.args = args
+
+
+class TransferQueue:
+    """Pending transfers of one kind (upload or download).
+
+    Lower project priority values are served first. Within a priority,
+    workers take the smallest file so small assets pass large ones. One
+    worker per queue always takes the oldest job so large files can't be
+    starved by a steady stream of small ones.
+    """
+
+    def __init__(self):
+        self.jobs = []
+        self.keys = set()  # Queued or running
+        self.cond = Condition()
+        self.order = count()
+
+    def put(self, job):
+        with self.cond:
+            if job.key in self.keys:
+                return False
+
+            job.seq = next(self.order)
+            self.jobs.append(job)
+            self.keys.add(job.key)
+            self.cond.notify()
+            return True
+
+    def get(self, oldest_first=False):
+        with self.cond:
+            while not self.jobs:
+                self.cond.wait()
+
+            if oldest_first:
+                job = min(self.jobs, key=lambda j: (j.priority, j.seq))
+            else:
+                job = min(self.jobs, key=lambda j: (j.priority, j.size, j.seq))
+
+            self.jobs.remove(job)
+            return job
+
+    def done(self, job):
+        with self.cond:
+            self.keys.discard(job.key)
+
+    def __contains__(self, key):
+        with self.cond:
+            return key in self.keys
+
+    def __len__(self):
+        with self.cond:
+            return len(self.jobs)
+
+
+class TransferWorker(Thread):
+    def __init__(self, transfer_queue, oldest_first=False, **kwargs):
+        super().__init__(**kwargs)
+        self.daemon = True
+        self.queue = transfer_queue
+        self.oldest_first = oldest_first
+
+    def run(self):
+        while True:
+            job = self.queue.get(oldest_first=self.oldest_first)
+            try:
+                job.func(*job.args)
+            except (requests.exceptions.ConnectionError,
+                    requests.exceptions.HTTPError) as e:
+                logger.info('{} of {} failed, retrying next scan: {}'.format(
+                    job.kind.capitalize(), job.key, e))
+            except Exception:  # skipcq: PYL-W0703
+                logger.exception('{} of {} failed'.format(
+                    job.kind.capitalize(), job.key))
+            finally:
+                # Keep the key until the job's DB writes have landed, or
+                # the next scan sees stale rows and queues it again.
+                db_queue.join()
+                self.queue.done(job)
+
+
+class TransferScheduler:
+    """Run uploads and downloads on bounded worker pools.
+
+    :Args:
+    upload_workers (int): Max concurrent uploads
+    download_workers (int): Max concurrent downloads
+    """
+
+    def __init__(self, upload_workers, download_workers):
+        self.queues = {'upload': TransferQueue(),
+                       'download': TransferQueue()}
+        self.workers = []
+
+        for kind, worker_count in (('upload', upload_workers),
+                                   ('download', download_workers)):
+            for i in range(max(worker_count, 1)):
+                self.workers.append(TransferWorker(
+                    self.queues[kind],
+                    oldest_first=(i == 0 and worker_count > 1),
+                    name='{}-worker-{}'.format(kind, i)))
+
+    def start(self):
+        for worker in self.workers:
+            worker.start()
+
+    def submit(self, kind, key, size, priority, func, *args):
+        """Queue a transfer. Returns False if key is already queued/running.
+
+        :Args:
+        kind (string): 'upload' or 'download'
+        key: Unique id for the transfer, e.g. DB asset id
+        size (int): File size in bytes
+        priority (int): Project priority, lower runs first
+        func (function): Called with args on a worker thread
+        """
+        job = TransferJob(key, kind, size, priority, func, args)
+        return self.queues[kind].put(job)
+
+    def is_queued(self, kind, key):
+        """True if transfer is waiting or running."""
+        return key in self.queues[kind]
+
+    def pending(self, kind):
+        return len(self.queues[kind])
@@ -0,0 +1,100 @@
+"""Time hot sync.db queries before and after the index migration.
+
+Run from the server folder: python -m utils.benchmark_indexes [asset_count]
+"""
+
+import os
+import random
+import sys
+import tempfile
+from time import perf_counter
+
+from peewee import SqliteDatabase, chunked
+
+from db_models import init_sync_models, run_migrations
+
+PROJECTS = 10
+REPEAT = 200
+
+
+def populate(Asset, count):
+    rows = []
+    for i in range(count):
+        rows.append({
+            'name': 'file_{}.mov'.format(i),
+            'path': 'folder_{}/file_{}.mov'.format(i % 500, i),
+            'is_file': i % 10 != 0,
+            'asset_id': 'asset-{}'.format(i),
+            'parent_id': 'asset-{}'.format(i - i % 10),
+            'project_id': 'project-{}'.format(i % PROJECTS),
+            'on_frameio': i % 7 != 0,
+            'on_local_storage': i % 5 != 0,
+            'upload_verified': i % 1000 != 0,
+        })
+
+    with Asset._meta.database.atomic():
+        for batch in chunked(rows, 50):
+            Asset.insert_many(batch).execute()
+
+
+def queries(Asset):
+    return [
+        ('asset_id', lambda i: Asset.get_or_none(
+            Asset.asset_id == 'asset-{}'.format(i))),
+        ('project_id, path', lambda i: Asset.get_or_none(
+            Asset.project_id == 'project-{}'.format(i % PROJECTS),
+            Asset.path == 'folder_{}/file_{}.mov'.format(i % 500, i))),
+        ('project_id, on_frameio, is_file', lambda i: list(
+            Asset.select().where(
+                (Asset.project_id == 'project-{}'.format(i % PROJECTS)) &
+                (Asset.on_frameio == False) &
+                (Asset.is_file == True)).limit(10))),
+        ('project_id, on_local_storage, ignore', lambda i: list(
+            Asset.select().where(
+                (Asset.project_id == 'project-{}'.format(i % PROJECTS)) &
+                (Asset.on_local_storage == False) &
+                (Asset.ignore == False)).limit(10))),
+        ('parent_id', lambda i: list(Asset.select().where(
+            Asset.parent_id == 'asset-{}'.format(i - i % 10)))),
+        ('upload_verified', lambda i: list(Asset.select().where(
+            Asset.upload_verified == False))),
+    ]
+
+
+def run(Asset, count):
+    timings = {}
+    for name, query in queries(Asset):
+        start = perf_counter()
+        for _ in range(REPEAT):
+            query(random.randrange(count))
+        timings[name] = (perf_counter() - start) / REPEAT * 1000
+
+    return timings
+
+
+if __name__ == '__main__':
+    asset_count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = SqliteDatabase(os.path.join(tmp, 'sync.db'),
+                            pragmas={'journal_mode': 'wal'})
+        Login, Project, Asset, IgnoreFolder = init_sync_models(db)
+
+        print('Populating {} assets'.format(asset_count))
+        populate(Asset, asset_count)
+
+        # Recreate a pre-index database
+        for index in db.get_indexes(Asset._meta.table_name):
+            db.execute_sql('DROP INDEX "{}"'.format(index.name))
+        db.pragma('user_version', 1)
+
+        before = run(Asset, asset_count)
+        run_migrations(db, new=False)
+        after = run(Asset, asset_count)
+
+        print('{:<40}{:>12}{:>12}'.format('Query', 'Before ms', 'After ms'))
+        for name in before:
+            print('{:<40}{:>12.3f}{:>12.3f}'.format(
+                name, before[name], after[name]))
+
+        db.close()
@@ -0,0 +1,50 @@
+"""Send a signed Frame.io-style webhook event to a local sync server.
+
+Run from the server folder, with the server's FRAMEIO_WEBHOOK_SECRET set:
+python -m utils.webhook_sender asset.ready <project_id> <asset_id> [url]
+"""
+
+import hashlib
+import hmac
+import json
+import sys
+from time import time
+
+import requests
+
+import config
+
+DEFAULT_URL = 'http://localhost:5111/api/webhook'
+
+
+def send_event(url, secret, event_type, project_id, asset_id):
+    body = json.dumps({
+        'type': event_type,
+        'resource': {'type': 'asset', 'id': asset_id},
+        'project': {'id': project_id},
+    }).encode()
+
+    timestamp = str(int(time()))
+    message = 'v0:{}:'.format(timestamp).encode() + body
+    signature = 'v0=' + hmac.new(secret.encode(), message,
+                                 hashlib.sha256).hexdigest()
+
+    return requests.post(url, data=body, headers={
+        'Content-Type': 'application/json',
+        'X-Frameio-Request-Timestamp': timestamp,
+        'X-Frameio-Signature': signature,
+    })
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 4:
+        print(__doc__)
+        sys.exit(1)
+
+    if not config.WEBHOOK_SECRET:
+        print('Set FRAMEIO_WEBHOOK_SECRET to sign the event')
+        sys.exit(1)
+
+    url = sys.argv[4] if len(sys.argv) > 4 else DEFAULT_URL
+    r = send_event(url, config.WEBHOOK_SECRET, *sys.argv[1:4])
+    print(r.status_code, r.text)
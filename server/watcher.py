@@ -0,0 +1,270 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+from threading import Lock, Thread
+from time import time
+
+from events import sync_wakeup
+from logger import logger
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (IN_CREATE | IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO |
+              IN_MOVED_FROM | IN_DELETE_SELF | IN_ONLYDIR | IN_DONT_FOLLOW)
+CHANGE_MASK = IN_CREATE | IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO
+
+EVENT_HEADER = struct.Struct('iIII')  # wd, mask, cookie, name length
+
+
+class Inotify:
+    """Minimal ctypes binding to the Linux inotify API."""
+
+    def __init__(self):
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+
+    @staticmethod
+    def available():
+        return sys.platform.startswith('linux')
+
+    def add_watch(self, path, mask):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), path)
+        return wd
+
+    def rm_watch(self, wd):
+        self.libc.inotify_rm_watch(self.fd, wd)
+
+    def read(self, timeout):
+        """Return list of (wd, mask, name) read within timeout secs."""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            events.append((wd, mask, os.fsdecode(name)))
+
+        return events
+
+
+class LocalWatcher(Thread):
+    """Watch synced project folders and collect changed paths.
+
+    A path is settled when it had no events for settle_time secs. Settled
+    paths are handed to SyncLoop through settled(), and sync_wakeup is set
+    for their project so it picks them up right away.
+
+    :Args:
+    settle_time (int): Secs without events before a path is settled
+    skip_dir (function): Called with folder path relative to the project
+      root, True to not watch it
+    """
+
+    def __init__(self, settle_time, skip_dir, **kwargs):
+        super().__init__(**kwargs)
+        self.daemon = True
+        self.inotify = Inotify()
+        self.settle_time = settle_time
+        self.skip_dir = skip_dir
+        self.lock = Lock()
+
+        self.roots = {}  # project_id -> abs root path
+        self.watches = {}  # wd -> (project_id, rel dir path)
+        self.pending = {}  # project_id -> {rel path: last event time}
+        self.ready = {}  # project_id -> set of settled rel paths
+        self.needs_full_scan = set()  # project_ids that lost events
+        self.full_scan_woken = set()  # Of those, ones SyncLoop was told about
+
+    def watch(self, project_id, root):
+        """Start watching project folder. Returns False if not possible."""
+        with self.lock:
+            if self.roots.get(project_id) == root:
+                return True
+
+            self._unwatch(project_id)
+            self.roots[project_id] = root
+            self.pending[project_id] = {}
+            self.ready[project_id] = set()
+
+            try:
+                self._add_tree(project_id, '', mark_pending=False)
+            except OSError as e:
+                logger.info('Could not watch {}, polling instead: {}'.format(
+                    root, e))
+                self._unwatch(project_id)
+                return False
+
+            return True
+
+    def unwatch(self, project_id):
+        with self.lock:
+            self._unwatch(project_id)
+
+    def watched_projects(self):
+        with self.lock:
+            return list(self.roots)
+
+    def is_watching(self, project_id, root):
+        with self.lock:
+            return self.roots.get(project_id) == root
+
+    def settled(self, project_id):
+        """Return and clear settled paths, and if a full scan is needed
+        because events were lost.
+        """
+        with self.lock:
+            paths = self.ready.get(project_id, set())
+            self.ready[project_id] = set()
+            full_scan = project_id in self.needs_full_scan
+            self.needs_full_scan.discard(project_id)
+            self.full_scan_woken.discard(project_id)
+            return paths, full_scan
+
+    def _unwatch(self, project_id):
+        for wd, (watched_project, _) in list(self.watches.items()):
+            if watched_project == project_id:
+                self.inotify.rm_watch(wd)
+                del self.watches[wd]
+
+        self.roots.pop(project_id, None)
+        self.pending.pop(project_id, None)
+        self.ready.pop(project_id, None)
+        self.full_scan_woken.discard(project_id)
+
+    def _add_tree(self, project_id, rel_dir, mark_pending=True):
+        """Watch folder and its sub-folders. Entries found in a folder that
+        was just created are marked pending, since they may have been
+        written before the watch was in place.
+        """
+        root = self.roots[project_id]
+        stack = [rel_dir]
+        while stack:
+            current = stack.pop()
+            abs_dir = os.path.join(root, current)
+            try:
+                wd = self.inotify.add_watch(abs_dir, WATCH_MASK)
+            except FileNotFoundError:
+                continue
+            self.watches[wd] = (project_id, current)
+
+            if mark_pending:
+                self.pending[project_id][current] = time()
+
+            try:
+                entries = list(os.scandir(abs_dir))
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+
+            for entry in entries:
+                if entry.name.startswith('.'):
+                    continue
+
+                path = os.path.join(current, entry.name)
+                if entry.is_dir(follow_symlinks=False):
+                    if not self.skip_dir(path):
+                        stack.append(path)
+                elif mark_pending:
+                    self.pending[project_id][path] = time()
+
+    def _remove_tree(self, project_id, rel_dir):
+        prefix = rel_dir + os.sep
+        for wd, (watched_project, path) in list(self.watches.items()):
+            if watched_project == project_id and (
+                    path == rel_dir or path.startswith(prefix)):
+                self.inotify.rm_watch(wd)
+                del self.watches[wd]
+
+    def _handle(self, wd, mask, name):
+        if mask & IN_Q_OVERFLOW:
+            logger.info('Too many file events, running full scan')
+            self.needs_full_scan.update(self.roots)
+            return
+
+        if wd not in self.watches:
+            return
+
+        project_id, rel_dir = self.watches[wd]
+
+        if mask & IN_IGNORED:
+            del self.watches[wd]
+            return
+
+        if not name or name.startswith('.'):
+            return
+
+        path = os.path.join(rel_dir, name)
+        is_dir = mask & IN_ISDIR
+
+        if is_dir and mask & IN_MOVED_FROM:
+            self._remove_tree(project_id, path)
+            return
+
+        if not mask & CHANGE_MASK:
+            return
+
+        if is_dir:
+            if mask & (IN_CREATE | IN_MOVED_TO) and not self.skip_dir(path):
+                try:
+                    self._add_tree(project_id, path)
+                except OSError as e:  # Usually out of inotify watches
+                    logger.info('Could not watch {}: {}'.format(path, e))
+                    self.needs_full_scan.add(project_id)
+            return
+
+        self.pending[project_id][path] = time()
+
+    def _settle(self):
+        now = time()
+        woken = self.needs_full_scan - self.full_scan_woken
+        self.full_scan_woken.update(woken)
+
+        for project_id, pending in self.pending.items():
+            settled = [p for p, t in pending.items()
+                       if now - t >= self.settle_time]
+            for path in settled:
+                del pending[path]
+            if settled:
+                self.ready[project_id].update(settled)
+                woken.add(project_id)
+
+        # Only the projects with changes, and once per change
+        for project_id in woken:
+            sync_wakeup.set('local', project_id=project_id)
+
+    def run(self):
+        while True:
+            events = self.inotify.read(timeout=1)
+            with self.lock:
+                for wd, mask, name in events:
+                    self._handle(wd, mask, name)
+                self._settle()